@@ -0,0 +1,177 @@
+from fullcontrol import Point
+from math import atan2, cos, sin
+from typing import Iterable, Iterator
+import numpy as np
+
+class ArcXY:
+    '''G2/G3 arc in the XY plane from (start_x, start_y) to (x, y) at height z around (centre_x, centre_y).
+    Extrusion is calculated from the arc length like fullcontrol does for a Point.
+    '''
+    def __init__(self, start_x: float, start_y: float, x: float, y: float, z: float, centre_x: float, centre_y: float, clockwise: bool, length: float) -> None:
+        self.start_x = start_x
+        self.start_y = start_y
+        self.x = x
+        self.y = y
+        self.z = z
+        self.centre_x = centre_x
+        self.centre_y = centre_y
+        self.clockwise = clockwise
+        self.length = length
+
+    def __repr__(self) -> str:
+        return f"ArcXY({'G2' if self.clockwise else 'G3'} x={self.x} y={self.y} z={self.z} centre=({self.centre_x}, {self.centre_y}))"
+
+    def points(self, segments: int = 16) -> list:
+        '''approximate the arc with Points, excluding the start point
+        '''
+        radius = ((self.start_x-self.centre_x)**2 + (self.start_y-self.centre_y)**2)**0.5
+        start_angle = atan2(self.start_y-self.centre_y, self.start_x-self.centre_x)
+        arc_angle = self.length/radius * (-1 if self.clockwise else 1)
+        points = [Point(x=self.centre_x+radius*cos(start_angle+arc_angle*index/segments),
+                        y=self.centre_y+radius*sin(start_angle+arc_angle*index/segments),
+                        z=self.z
+                        ) for index in range(1, segments)]
+        points.append(Point(x=self.x, y=self.y, z=self.z))
+        return points
+
+    def gcode(self, state) -> str:
+        '''process this arc in a list of steps to generate a line of gcode, see fullcontrol's Point.gcode()
+        '''
+        end = Point(x=self.x, y=self.y, z=self.z)
+        G_str = 'G2 ' if self.clockwise else 'G3 '
+        F_str = state.printer.f_gcode(state)
+        XYZ_str = end.XYZ_gcode(state.point) or ''
+        IJ_str = _number('I', self.centre_x-self.start_x) + ' ' + _number('J', self.centre_y-self.start_y) + ' '
+        E_str = ''
+        if state.extruder.on:
+            E_str = _number('E', state.extruder.get_and_update_volume(self.length*state.extrusion_geometry.area)*state.extruder.volume_to_e)
+        state.printer.speed_changed = False
+        state.point.update_from(end)
+        return f'{G_str}{F_str}{XYZ_str}{IJ_str}{E_str}'.strip()
+
+    def visualize(self, state, plot_data, plot_controls) -> None:
+        '''plot the arc as short lines
+        '''
+        for point in self.points():
+            point.visualize(state, plot_data, plot_controls)
+
+def _number(letter: str, value: float) -> str:
+    text = f'{value:.6f}'.rstrip('0').rstrip('.')
+    return letter + ('0' if text == '-0' else text)
+
+def _circle(start: np.ndarray, middle: np.ndarray, end: np.ndarray) -> tuple|None:
+    '''centre and radius of the circle through three XY points, None if they are (nearly) collinear
+    '''
+    ax, ay = start
+    bx, by = middle
+    cx, cy = end
+    determinant = 2*(ax*(by-cy) + bx*(cy-ay) + cx*(ay-by))
+    if abs(determinant) < 1e-12:
+        return None
+    centre_x = ((ax**2+ay**2)*(by-cy) + (bx**2+by**2)*(cy-ay) + (cx**2+cy**2)*(ay-by))/determinant
+    centre_y = ((ax**2+ay**2)*(cx-bx) + (bx**2+by**2)*(ax-cx) + (cx**2+cy**2)*(bx-ax))/determinant
+    centre = np.array([centre_x, centre_y])
+    return centre, float(np.linalg.norm(start-centre))
+
+def _fit(points: np.ndarray, tolerance: float, max_radius: float) -> tuple|None:
+    '''fit a single arc through all XY points, returns (centre, clockwise, length) if every point and every chord
+    is within tolerance of the arc and the arc turns in one direction for less than a full circle
+    '''
+    circle = _circle(points[0], points[len(points)//2], points[-1])
+    if circle is None:
+        return None
+    centre, radius = circle
+    if radius > max_radius:
+        return None
+
+    relative = points - centre
+    if np.max(np.abs(np.linalg.norm(relative, axis=1) - radius)) > tolerance:
+        return None
+
+    chords = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    if np.any(chords > 2*radius) or np.max(radius - np.sqrt(radius**2 - (chords/2)**2)) > tolerance:
+        return None
+
+    angles = np.arctan2(relative[:, 1], relative[:, 0])
+    turns = (np.diff(angles) + np.pi) % (2*np.pi) - np.pi
+    if not (np.all(turns > 0) or np.all(turns < 0)):
+        return None
+    arc_angle = float(turns.sum())
+    if abs(arc_angle) >= 1.9*np.pi:
+        return None
+
+    return centre, arc_angle < 0, radius*abs(arc_angle)
+
+def fit_arcs(coordinates: np.ndarray, tolerance: float, min_segments: int = 3, max_radius: float = 1000) -> list:
+    '''greedily replace runs of at least min_segments lines through the (n, 3) coordinates by arcs that stay within tolerance.
+    The coordinates must share one z. Returns a list of (end_index, arc) where arc is None for a straight line to that index
+    '''
+    points = np.asarray(coordinates, dtype=float)[:, :2]
+    point_count = len(points)
+    moves = []
+    start = 0
+    while start < point_count-1:
+        end = start + min_segments
+        fit = _fit(points[start:end+1], tolerance, max_radius) if end < point_count else None
+        if fit is None:
+            moves.append((start+1, None))
+            start += 1
+            continue
+
+        # grow the arc exponentially, then narrow down on the longest arc that still fits
+        step = min_segments
+        while end+step < point_count and (candidate := _fit(points[start:end+step+1], tolerance, max_radius)) is not None:
+            end, fit, step = end+step, candidate, step*2
+        low, high = end, min(end+step, point_count-1)
+        # growth stopped at the last point without trying it
+        if end+step >= point_count and high > low and (candidate := _fit(points[start:high+1], tolerance, max_radius)) is not None:
+            low, fit = high, candidate
+        while high - low > 1:
+            middle = (low+high)//2
+            candidate = _fit(points[start:middle+1], tolerance, max_radius)
+            if candidate is None:
+                high = middle
+            else:
+                low, fit = middle, candidate
+        end = low
+
+        moves.append((end, fit))
+        start = end
+    return moves
+
+def iter_arcs(steps: Iterable, tolerance: float, min_segments: int = 3) -> Iterator:
+    '''lazily replace runs of consecutive Points at the same height in fullcontrol steps by ArcXY steps where
+    the points lie on an arc within tolerance. Other steps are passed through, so only one run is held in memory
+    '''
+    run = []
+    for step in steps:
+        is_point = type(step) == Point and None not in (step.x, step.y, step.z)
+        if is_point and (not run or step.z == run[0].z):
+            run.append(step)
+            continue
+        yield from _arcs_from_run(run, tolerance, min_segments)
+        run = [step] if is_point else []
+        if not is_point:
+            yield step
+    yield from _arcs_from_run(run, tolerance, min_segments)
+
+def _arcs_from_run(run: list, tolerance: float, min_segments: int) -> Iterator:
+    if len(run) <= min_segments:
+        yield from run
+        return
+    yield run[0]
+    previous_index = 0
+    for end_index, fit in fit_arcs(np.array([(point.x, point.y, point.z) for point in run]), tolerance, min_segments):
+        if fit is None:
+            yield run[end_index]
+        else:
+            centre, clockwise, length = fit
+            yield ArcXY(run[previous_index].x, run[previous_index].y, run[end_index].x, run[end_index].y, run[end_index].z,
+                        float(centre[0]), float(centre[1]), clockwise, length
+                        )
+        previous_index = end_index
+
+def arcs_from_steps(steps: list, tolerance: float, min_segments: int = 3) -> list:
+    '''replace runs of consecutive Points at the same height in a list of fullcontrol steps by ArcXY steps, see iter_arcs()
+    '''
+    return list(iter_arcs(steps, tolerance, min_segments))
@@ -0,0 +1,91 @@
+'''generate gcode for many feathers or plates in parallel, one process per CPU core
+
+jobs are (name, design) pairs, where design is a FabulousFeather or FeatherPlate. Output files are numbered in job
+order, so a batch always produces the same files regardless of which job finishes first.
+'''
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from typing import Callable
+from fullcontrol import GcodeControls
+from fabulousfeathers import FabulousFeather
+from featherplate import FeatherPlate
+
+def sweep(feather: FabulousFeather, **parameter_values: list) -> list:
+    '''jobs for every combination of the given parameter values, e.g. sweep(feather, vane_width=[30, 40], vane_PA=[0.02, 0.04])
+    '''
+    names = list(parameter_values)
+    jobs = []
+    for values in product(*parameter_values.values()):
+        changes = dict(zip(names, values))
+        jobs.append(('_'.join(f'{name}={value}' for name, value in changes.items()), feather.replace(**changes)))
+    return jobs
+
+def _file_name(index: int, name: str) -> str:
+    safe_name = ''.join(character if character.isalnum() or character in '=.-' else '_' for character in name)
+    return f'{index:04d}_{safe_name}.gcode'
+
+def _run_job(index: int, name: str, design: FabulousFeather|FeatherPlate, path: str, gcode_controls: GcodeControls|None, arc_tolerance: float|None) -> dict:
+    '''generate the gcode for one job, the file only appears once it is complete
+    '''
+    result = {'index': index, 'name': name, 'path': path, 'error': None}
+    start = time.perf_counter()
+    try:
+        with open(path + '.part', 'w') as file:
+            result['lines'] = design.write_gcode(file, gcode_controls, arc_tolerance=arc_tolerance)
+        os.replace(path + '.part', path)
+        result['bytes'] = os.path.getsize(path)
+    except Exception:
+        result['error'] = traceback.format_exc()
+        if os.path.exists(path + '.part'):
+            os.remove(path + '.part')
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def _format(result: dict, done: int, total: int) -> str:
+    if result['error'] is not None:
+        return f"[{done}/{total}] {result['name']}: FAILED\n{result['error']}"
+    return f"[{done}/{total}] {result['name']}: {result['lines']} lines in {result['seconds']:.2f} s"
+
+def run_batch(jobs: list,
+              output_directory: str,
+              gcode_controls: GcodeControls|None = None,
+              processes: int|None = None,
+              arc_tolerance: float|None = None,
+              log: Callable[[str], None]|None = print
+              ) -> list:
+    '''generate gcode for all jobs in a process pool and write it to numbered files in output_directory, together with a
+    manifest.json. Jobs are (name, design) pairs or just designs. processes defaults to the number of CPU cores, use 1 to
+    run in the current process. Failed jobs do not stop the batch, returns a result per job in job order.
+    '''
+    jobs = [job if type(job) == tuple else ('job', job) for job in jobs]
+    os.makedirs(output_directory, exist_ok=True)
+    arguments = [(index, name, design, os.path.join(output_directory, _file_name(index, name)), gcode_controls, arc_tolerance)
+                 for index, (name, design) in enumerate(jobs)]
+
+    results = []
+    if processes == 1:
+        for job_arguments in arguments:
+            results.append(_run_job(*job_arguments))
+            if log is not None:
+                log(_format(results[-1], len(results), len(arguments)))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_run_job, *job_arguments) for job_arguments in arguments]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if log is not None:
+                    log(_format(results[-1], len(results), len(arguments)))
+    results.sort(key=lambda result: result['index'])
+
+    with open(os.path.join(output_directory, 'manifest.json'), 'w') as file:
+        json.dump([{key: value for key, value in result.items() if key != 'path'} | {'file': os.path.basename(result['path'])}
+                   for result in results], file, indent=1)
+
+    if log is not None:
+        failed = sum(result['error'] is not None for result in results)
+        log(f'{len(results)-failed} of {len(results)} jobs written to {output_directory}' + (f', {failed} failed' if failed else ''))
+    return results
@@ -0,0 +1,277 @@
+'''benchmark feather generation, gcode transform, batch plates and command line startup over a grid of design parameters
+
+usage: python benchmark.py [--quick] [--repeat N] [--output results.json] [--compare previous.json]
+
+Every case records wall time, peak memory, step count and gcode size per phase. Results are stored as JSON
+together with the git commit, so runs on different commits can be compared with --compare.
+'''
+import argparse
+import asyncio
+import json
+import platform
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from itertools import product
+from math import ceil, sqrt
+import fullcontrol as fc
+from fabulousfeathers import FabulousFeather
+from featherplate import FeatherPlate
+from feathercache import FeatherCache
+from printestimate import estimate_print
+from preview import render_png
+from platevalidation import validate_plate
+from printerstream import FakePrinter, stream
+from fabuloushelpers import cartesian_ellipse_arc_arrayXY, vane_arrayXY
+
+BARB_SPACINGS = [0.05, 0.1, 0.2, 0.4] # mm
+RACHIS_LENGTHS = [20, 50, 100, 150] # mm
+RACHIS_LAYERS = [1, 5, 10, 20]
+PLATE_SIZES = [1, 10, 100] # feathers
+
+QUICK_BARB_SPACINGS = [0.05, 0.4]
+QUICK_RACHIS_LENGTHS = [20, 150]
+QUICK_RACHIS_LAYERS = [1, 20]
+QUICK_PLATE_SIZES = [1, 10]
+
+def design(barb_spacing: float = 0.2, rachis_length: float = 75, rachis_layers: int = 2) -> FabulousFeather:
+    '''feather from the Fabulous Feathers notebook with some parameters changed
+    '''
+    EW = 0.4
+    quill_EH = 0.5
+    return FabulousFeather(start_point=fc.Point(x=15, y=15, z=0),
+                           EW=EW,
+                           EH=0.2,
+                           barb_spacing=barb_spacing,
+                           barb_quill_connection=1.5*EW,
+                           vane_width=40,
+                           vane_rachis_extent=7.5,
+                           rachis_length=rachis_length,
+                           quill_length=30,
+                           quill_width=1.8,
+                           quill_EH=quill_EH,
+                           quill_height=rachis_layers*quill_EH,
+                           afterfeather_length=30,
+                           afterfeather_extent=2.75*30,
+                           z_lift=0.6,
+                           vane_speed=1000,
+                           quill_speed=200,
+                           retraction=True
+                           )
+
+def gcode_controls() -> fc.GcodeControls:
+    return fc.GcodeControls(printer_name='generic', initialization_data={'extrusion_width': 0.4, 'extrusion_height': 0.2})
+
+class _ByteCounter:
+    '''text file stand-in which only counts the bytes written to it
+    '''
+    def __init__(self) -> None:
+        self.bytes = 0
+
+    def write(self, text: str) -> None:
+        self.bytes += len(text.encode())
+
+def _measure(function, repeat: int) -> dict:
+    '''best wall time over repeat runs, and peak memory traced in a separate run
+    '''
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': min(seconds), 'peak_bytes': peak_bytes, **result}
+
+def feather_phases(feather: FabulousFeather) -> dict:
+    '''benchmark functions for each phase of generating a single feather
+    '''
+    def helpers() -> dict:
+        barb_count_per_side = int(feather.rachis_length/(feather.EW+feather.barb_spacing))
+        centre = fc.Point(x=feather.quill_length+feather.afterfeather_length, y=0, z=feather.EH)
+        barbs = vane_arrayXY(cartesian_ellipse_arc_arrayXY(centre, feather.rachis_length, feather.quill_width/2-feather.barb_quill_connection, 0.5, 1.0, barb_count_per_side, True),
+                             cartesian_ellipse_arc_arrayXY(centre, feather.rachis_length+feather.vane_rachis_extent, feather.vane_width/2, 0.5, 0.98, barb_count_per_side, True)
+                             )
+        return {'steps': 2*len(barbs)}
+
+    def rachis() -> dict:
+        return {'steps': len(feather.planar_rachis_buffer())}
+
+    def continuous_rachis() -> dict:
+        return {'steps': len(feather.continuous_rachis_buffer())}
+
+    def step_buffer() -> dict:
+        return {'steps': len(feather.step_buffer())}
+
+    def steps() -> dict:
+        return {'steps': len(feather.steps())}
+
+    def transform() -> dict:
+        steps = feather.steps()
+        gcode = fc.transform(steps, 'gcode', gcode_controls(), show_tips=False)
+        return {'steps': len(steps), 'gcode_bytes': len(gcode.encode())}
+
+    def stream() -> dict:
+        counter = _ByteCounter()
+        line_count = feather.write_gcode(counter, gcode_controls())
+        return {'gcode_lines': line_count, 'gcode_bytes': counter.bytes}
+
+    cache = FeatherCache(gcode=True)
+    def cached_stream() -> dict:
+        # the first run fills the cache, the fastest run is a cache hit
+        FabulousFeather.cache = cache
+        try:
+            return stream()
+        finally:
+            FabulousFeather.cache = None
+
+    return {'helpers': helpers, 'rachis': rachis, 'continuous_rachis': continuous_rachis, 'step_buffer': step_buffer, 'steps': steps, 'transform': transform, 'stream': stream, 'cached_stream': cached_stream}
+
+def plate_phases(feather_count: int) -> dict:
+    '''benchmark functions for generating a plate of feathers
+    '''
+    x_feathers = ceil(sqrt(feather_count))
+    y_feathers = ceil(feather_count/x_feathers)
+
+    def plate_steps() -> dict:
+        plate = FeatherPlate.grid(design(), x_feathers, y_feathers, feather_spacing=5)
+        return {'steps': len(plate.step_buffer())}
+
+    def plate_stream() -> dict:
+        plate = FeatherPlate.grid(design(), x_feathers, y_feathers, feather_spacing=5)
+        counter = _ByteCounter()
+        line_count = plate.write_gcode(counter, gcode_controls())
+        return {'gcode_lines': line_count, 'gcode_bytes': counter.bytes}
+
+    def plate_estimate() -> dict:
+        plate = FeatherPlate.grid(design(), x_feathers, y_feathers, feather_spacing=5)
+        return {'steps': len(plate.step_buffer()), 'print_time': estimate_print(plate)['total_time']}
+
+    def plate_preview() -> dict:
+        plate = FeatherPlate.grid(design(), x_feathers, y_feathers, feather_spacing=5)
+        return {'steps': len(plate.step_buffer()), 'png_bytes': len(render_png(plate))}
+
+    def plate_validation() -> dict:
+        plate = FeatherPlate.grid(design(), x_feathers, y_feathers, feather_spacing=5)
+        report = validate_plate(plate)
+        return {'steps': len(plate.step_buffer()), 'segments': report['segments'], 'valid': report['valid']}
+
+    def plate_printer_stream() -> dict:
+        plate = FeatherPlate.grid(design(), x_feathers, y_feathers, feather_spacing=5)
+
+        async def send() -> dict:
+            async with FakePrinter('moonraker') as printer:
+                return await stream(plate, printer.transport(), gcode_controls())
+
+        report = asyncio.run(send())
+        return {'gcode_lines': report['lines_sent'], 'lines_per_second': report['lines_per_second']}
+
+    return {'plate_steps': plate_steps, 'plate_stream': plate_stream, 'plate_estimate': plate_estimate, 'plate_preview': plate_preview, 'plate_validation': plate_validation, 'plate_printer_stream': plate_printer_stream}
+
+def startup_phases() -> dict:
+    '''benchmark functions for starting the command line interface in a new process, timed from outside.
+    Peak memory only covers this process, not the child
+    '''
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+
+    def cli_help() -> dict:
+        subprocess.run([sys.executable, cli, '--help'], check=True, capture_output=True)
+        return {}
+
+    def cli_small_feather() -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            parameters = os.path.join(directory, 'parameters.json')
+            with open(parameters, 'w') as file:
+                json.dump({'rachis_length': 20, 'vane_width': 10, 'quill_length': 10, 'afterfeather_length': 5}, file)
+            subprocess.run([sys.executable, cli, parameters, '--output', os.path.join(directory, 'feather.gcode')], check=True, capture_output=True)
+            return {'gcode_bytes': os.path.getsize(os.path.join(directory, 'feather.gcode'))}
+
+    return {'cli_help': cli_help, 'cli_small_feather': cli_small_feather}
+
+def run(quick: bool = False, repeat: int = 3, log=print) -> dict:
+    '''run all benchmark cases and return the results
+    '''
+    # measure generation itself, not cache hits
+    FabulousFeather.cache = None
+    results = []
+    grid = product(QUICK_BARB_SPACINGS if quick else BARB_SPACINGS,
+                   QUICK_RACHIS_LENGTHS if quick else RACHIS_LENGTHS,
+                   QUICK_RACHIS_LAYERS if quick else RACHIS_LAYERS
+                   )
+    for barb_spacing, rachis_length, rachis_layers in grid:
+        case = {'barb_spacing': barb_spacing, 'rachis_length': rachis_length, 'rachis_layers': rachis_layers}
+        for phase, function in feather_phases(design(**case)).items():
+            results.append({**case, 'phase': phase, **_measure(function, repeat)})
+            log(_format(results[-1]))
+
+    for feather_count in QUICK_PLATE_SIZES if quick else PLATE_SIZES:
+        for phase, function in plate_phases(feather_count).items():
+            results.append({'feathers': feather_count, 'phase': phase, **_measure(function, 1 if feather_count > 10 else repeat)})
+            log(_format(results[-1]))
+
+    for phase, function in startup_phases().items():
+        results.append({'phase': phase, **_measure(function, repeat)})
+        log(_format(results[-1]))
+
+    return {'commit': _git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'results': results
+            }
+
+def _case_key(result: dict) -> tuple:
+    return tuple((name, value) for name, value in sorted(result.items()) if name in ('barb_spacing', 'rachis_length', 'rachis_layers', 'feathers', 'phase'))
+
+def compare(previous: dict, current: dict, threshold: float = 1.2) -> list:
+    '''compare two benchmark runs, returns (case, previous seconds, current seconds) for cases that got slower by more than threshold
+    '''
+    previous_seconds = {_case_key(result): result['seconds'] for result in previous['results']}
+    regressions = []
+    for result in current['results']:
+        key = _case_key(result)
+        if key in previous_seconds and result['seconds'] > threshold*previous_seconds[key]:
+            regressions.append((dict(key), previous_seconds[key], result['seconds']))
+    return regressions
+
+def _format(result: dict) -> str:
+    case = ' '.join(f'{name}={value}' for name, value in _case_key(result) if name != 'phase')
+    return f"{result['phase']:>17} {case:<55} {result['seconds']*1000:10.1f} ms {result['peak_bytes']/1e6:9.2f} MB" + \
+        (f" {result['steps']:>9} steps" if 'steps' in result else '') + \
+        (f" {result['gcode_bytes']/1e6:8.2f} MB gcode" if 'gcode_bytes' in result else '')
+
+def _git_commit() -> str|None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark Fabulous Feathers generation')
+    parser.add_argument('--quick', action='store_true', help='run a reduced parameter grid')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per case, the fastest is reported')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to store the results in')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown factor reported as a regression by --compare')
+    arguments = parser.parse_args()
+
+    results = run(arguments.quick, arguments.repeat)
+    with open(arguments.output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print(f'results written to {arguments.output}')
+
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            regressions = compare(json.load(file), results, arguments.threshold)
+        for case, previous_seconds, seconds in regressions:
+            print(f'regression: {case} {previous_seconds*1000:.1f} ms -> {seconds*1000:.1f} ms')
+        if not regressions:
+            print('no regressions')
@@ -0,0 +1,262 @@
+'''generate gcode for a feather or a plate of feathers without a notebook
+
+usage: python cli.py parameters.yaml [--output feather.gcode] [--plot] [--preview preview.png] [--estimate] [--validate] [--timings]
+
+The parameter file (YAML or JSON) uses the names of the parameter cells in the Fabulous Feathers notebook, e.g.
+
+    design_name: fabulous_feathers
+    nozzle_diameter: 0.4
+    vane_width: 40
+    rachis_length: 75
+
+Missing parameters take the notebook values. Adding x_feathers, y_feathers and feather_spacing (like the batch print
+notebook) generates a plate. Only argparse and json are imported up front: fullcontrol, numpy and the feather modules are
+imported once the parameters are read, YAML only for .yaml files and the plotting stack only with --plot.
+--estimate prints the estimated print time and filament use, see printestimate.py. --preview writes a fast top-down
+.svg or .png preview, see preview.py. --validate checks for overlapping feathers, low travels and, when bed_size is set,
+moves outside the bed, see platevalidation.py.
+'''
+import argparse
+import json
+import sys
+import time
+
+# parameter cells of the Fabulous Feathers notebook, None is derived from other parameters like in the notebook
+PRINTER_PARAMETERS = {'design_name': 'fabulous_feathers',
+                      'nozzle_diameter': 0.4,
+                      'nozzle_temp': 220,
+                      'bed_temp': 70,
+                      'print_speed': 1000,
+                      'quill_speed': 200,
+                      'fan_percent': 0,
+                      'retraction': True,
+                      'z_lift': 0.6,
+                      'material_flow_percent': 100,
+                      'vane_pressure_advance': None,
+                      'rachis_pressure_advance': None,
+                      'printer_name': 'generic',
+                      'bed_size': None # [x, y] mm, only used by --validate
+                      }
+DESIGN_PARAMETERS = {'EW': None, # 1.0*nozzle_diameter
+                     'EH': 0.2,
+                     'x_offset': 15,
+                     'y_offset': 15,
+                     'rotation': None, # degrees, 45 for a single feather like the notebook, 0 for a plate
+                     'barb_spacing': 0.2,
+                     'barb_rachis_connection': None, # 1.5*EW
+                     'vane_width': 40,
+                     'vane_rachis_extent': 7.5,
+                     'rachis_length': 75,
+                     'quill_length': 30,
+                     'quill_width': 1.8,
+                     'quill_EH': 0.5,
+                     'quill_height': None, # 2*quill_EH
+                     'afterfeather_length': 30,
+                     'afterfeather_extent': None, # 2.75*afterfeather_length
+                     'wipe_distance': 0,
+                     'continuous_rachis': False,
+                     'chordal_tolerance': None,
+                     'arc_tolerance': None
+                     }
+PLATE_PARAMETERS = {'x_feathers': None,
+                    'y_feathers': None,
+                    'feather_spacing': 5
+                    }
+
+def read_parameters(path: str) -> dict:
+    '''read a YAML or JSON parameter file and fill in the notebook defaults
+    '''
+    with open(path) as file:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            values = yaml.safe_load(file) or {}
+        else:
+            values = json.load(file)
+
+    defaults = {**PRINTER_PARAMETERS, **DESIGN_PARAMETERS, **PLATE_PARAMETERS}
+    unknown = set(values) - set(defaults)
+    if unknown:
+        raise Exception(f"unknown parameters in {path}: {', '.join(sorted(unknown))}")
+    parameters = {**defaults, **values}
+
+    derived = {'EW': lambda: 1.0*parameters['nozzle_diameter'],
+               'barb_rachis_connection': lambda: 1.5*parameters['EW'],
+               'quill_height': lambda: 2*parameters['quill_EH'],
+               'afterfeather_extent': lambda: 2.75*parameters['afterfeather_length'],
+               'rotation': lambda: 0 if parameters['x_feathers'] is not None else 45
+               }
+    for name, value in derived.items():
+        if parameters[name] is None:
+            parameters[name] = value()
+    if (parameters['x_feathers'] is None) != (parameters['y_feathers'] is None):
+        raise Exception("x_feathers and y_feathers must be set together")
+    return parameters
+
+def build(parameters: dict):
+    '''create the FabulousFeather, or FeatherPlate when x_feathers and y_feathers are set, and the GcodeControls
+    '''
+    import fullcontrol as fc
+    from fabulousfeathers import FabulousFeather
+    from featherplate import FeatherPlate
+
+    feather = FabulousFeather(start_point=fc.Point(x=parameters['x_offset'], y=parameters['y_offset'], z=0),
+                              EW=parameters['EW'],
+                              EH=parameters['EH'],
+                              barb_spacing=parameters['barb_spacing'],
+                              barb_quill_connection=parameters['barb_rachis_connection'],
+                              vane_width=parameters['vane_width'],
+                              vane_rachis_extent=parameters['vane_rachis_extent'],
+                              rachis_length=parameters['rachis_length'],
+                              quill_length=parameters['quill_length'],
+                              quill_width=parameters['quill_width'],
+                              quill_EH=parameters['quill_EH'],
+                              quill_height=parameters['quill_height'],
+                              afterfeather_length=parameters['afterfeather_length'],
+                              afterfeather_extent=parameters['afterfeather_extent'],
+                              z_lift=parameters['z_lift'],
+                              wipe_distance=parameters['wipe_distance'],
+                              vane_speed=parameters['print_speed'],
+                              quill_speed=parameters['quill_speed'],
+                              retraction=parameters['retraction'],
+                              vane_PA=parameters['vane_pressure_advance'],
+                              rachis_PA=parameters['rachis_pressure_advance'],
+                              chordal_tolerance=parameters['chordal_tolerance'],
+                              continuous_rachis=parameters['continuous_rachis']
+                              )
+    design = feather
+    if parameters['x_feathers'] is not None:
+        if parameters['rotation']:
+            raise Exception("rotation is not supported for plates")
+        design = FeatherPlate.grid(feather, parameters['x_feathers'], parameters['y_feathers'], parameters['feather_spacing'])
+
+    gcode_controls = fc.GcodeControls(printer_name=parameters['printer_name'],
+                                      initialization_data={'primer': 'front_lines_then_x',
+                                                           'print_speed': parameters['print_speed'],
+                                                           'nozzle_temp': parameters['nozzle_temp'],
+                                                           'bed_temp': parameters['bed_temp'],
+                                                           'fan_percent': parameters['fan_percent'],
+                                                           'extrusion_width': parameters['EW'],
+                                                           'extrusion_height': parameters['EH'],
+                                                           'material_flow_percent': parameters['material_flow_percent']
+                                                           }
+                                      )
+    return design, gcode_controls
+
+def design_steps(design, parameters: dict):
+    '''lazily yield the steps of the design, rotated about its start point like the notebook, with G2/G3 arcs when arc_tolerance is set
+    '''
+    if parameters['rotation'] == 0:
+        return design.iter_steps(arc_tolerance=parameters['arc_tolerance'])
+
+    from math import radians
+    from stepbuffer import steps_from_buffers
+    from arcfitting import iter_arcs
+
+    def rotated_sections():
+        for section in design.iter_sections():
+            section.rotate(design.start_point, radians(parameters['rotation']))
+            yield section
+
+    steps = steps_from_buffers(rotated_sections(), variable_width_lines=True)
+    if parameters['arc_tolerance'] is not None:
+        steps = iter_arcs(steps, parameters['arc_tolerance'])
+    return steps
+
+def write(design, parameters: dict, gcode_controls, file) -> int:
+    '''stream the gcode of the design to an open text file
+    '''
+    if parameters['rotation'] == 0:
+        return design.write_gcode(file, gcode_controls, arc_tolerance=parameters['arc_tolerance'])
+
+    from gcodestream import write_gcode
+    return write_gcode(design_steps(design, parameters), file, gcode_controls)
+
+def plot(design, parameters: dict) -> None:
+    import fullcontrol as fc
+    from math import radians
+
+    steps = design.steps()
+    if parameters['rotation'] != 0:
+        steps = fc.move_polar(steps, design.start_point, 0, radians(parameters['rotation']))
+    fc.transform(steps, 'plot', fc.PlotControls(tube_type='cylinders'))
+
+def write_preview(design, parameters: dict, path: str) -> None:
+    from math import radians
+    from preview import save_preview
+
+    buffer = design.step_buffer()
+    if parameters['rotation'] != 0:
+        buffer.rotate(design.start_point, radians(parameters['rotation']))
+    save_preview(buffer, path)
+
+def validate(design, parameters: dict) -> dict:
+    from math import radians
+    from platevalidation import validate_plate
+
+    bed = None if parameters['bed_size'] is None else (0, 0, *parameters['bed_size'])
+    if parameters['x_feathers'] is not None:
+        return validate_plate(design, bed=bed)
+
+    # a single feather is rotated about its start point like the gcode
+    buffer = design.step_buffer()
+    if parameters['rotation'] != 0:
+        buffer.rotate(design.start_point, radians(parameters['rotation']))
+    return validate_plate(buffer, bed=bed)
+
+def main(arguments: list|None = None) -> None:
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(description='generate gcode for Fabulous Feathers from a YAML or JSON parameter file')
+    parser.add_argument('parameters', help='YAML or JSON file with the parameters of the notebook')
+    parser.add_argument('--output', '-o', help="gcode file to write, '-' for stdout, defaults to <design_name>.gcode")
+    parser.add_argument('--plot', action='store_true', help="show an interactive plot of the design")
+    parser.add_argument('--preview', help='write a top-down preview of the design to a .svg or .png file')
+    parser.add_argument('--estimate', action='store_true', help='print the estimated print time and filament use to stderr')
+    parser.add_argument('--validate', action='store_true', help='check for overlapping feathers, low travels and moves outside the bed, report to stderr')
+    parser.add_argument('--timings', action='store_true', help='print the time taken by each stage to stderr')
+    arguments = parser.parse_args(arguments)
+
+    timings = {}
+    parameters = read_parameters(arguments.parameters)
+    timings['parameters'] = time.perf_counter() - start
+
+    design, gcode_controls = build(parameters)
+    timings['imports'] = time.perf_counter() - start - sum(timings.values())
+
+    output = arguments.output or parameters['design_name'] + '.gcode'
+    if output == '-':
+        line_count = write(design, parameters, gcode_controls, sys.stdout)
+    else:
+        with open(output, 'w') as file:
+            line_count = write(design, parameters, gcode_controls, file)
+    timings['gcode'] = time.perf_counter() - start - sum(timings.values())
+
+    if arguments.estimate:
+        from printestimate import estimate_print
+        estimate = estimate_print(design, print_speed=parameters['print_speed'])
+        timings['estimate'] = time.perf_counter() - start - sum(timings.values())
+        print(f"estimated print time {estimate['total_time']/60:.1f} min, filament {estimate['filament_length']/1000:.2f} m ({estimate['filament_mass']:.1f} g)", file=sys.stderr)
+
+    if arguments.validate:
+        report = validate(design, parameters)
+        timings['validate'] = time.perf_counter() - start - sum(timings.values())
+        for check in ('out_of_bed', 'overlaps', 'low_travels'):
+            if report[check] is not None and report[check]['count']:
+                print(f"{report[check]['count']} {check.replace('_', ' ')}, first at {report[check]['issues'][0]['location']}", file=sys.stderr)
+        if report['valid']:
+            print('design is valid', file=sys.stderr)
+
+    if arguments.plot:
+        plot(design, parameters)
+        timings['plot'] = time.perf_counter() - start - sum(timings.values())
+
+    if arguments.preview:
+        write_preview(design, parameters, arguments.preview)
+        timings['preview'] = time.perf_counter() - start - sum(timings.values())
+
+    if output != '-':
+        print(f'{line_count} lines written to {output}', file=sys.stderr)
+    if arguments.timings:
+        print(' '.join(f'{stage} {seconds*1000:.1f} ms' for stage, seconds in timings.items()) + f' total {(time.perf_counter()-start)*1000:.1f} ms', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,27 @@
-from fullcontrol import Point, travel_to, ExtrusionGeometry, Printer, Vector, move, PrinterCommand
+from fullcontrol import Point, Vector, GcodeControls
 from math import floor, sqrt
-from fabuloushelpers import vaneXY, cartesian_ellipse_arcXY, single_line_quill_rachisXY
-from z_lift import z_lift
+from typing import Iterator, TextIO
+from inspect import signature
+import numpy as np
+from fabuloushelpers import vane_arrayXY, cartesian_ellipse_arc_arrayXY, single_line_quill_rachis_arrayXY, single_line_quill_rachis_array3D
+from stepbuffer import StepBuffer, steps_from_buffers
+from stepbuilder import StepBuilder
+from gcodestream import write_gcode
+from arcfitting import iter_arcs
+from generationstats import GenerationStats
 from set_linear_advance import set_linear_advance
+from feathercache import FeatherCache, component_key
+
+# parameters the geometry of each component depends on, everything else is applied afterwards
+VANE_PARAMETERS = ('EW', 'EH', 'barb_spacing', 'barb_quill_connection', 'vane_width', 'vane_rachis_extent', 'rachis_length',
+                   'quill_length', 'quill_width', 'afterfeather_length', 'afterfeather_extent', 'z_lift', 'retraction')
+RACHIS_PARAMETERS = ('rachis_length', 'quill_length', 'quill_width', 'quill_EH', 'quill_height', 'afterfeather_length',
+                     'z_lift', 'wipe_distance', 'retraction', 'chordal_tolerance', 'min_segment_length')
 
 class FabulousFeather:
+    # geometry components are shared between feathers with the same parameters, set to None to always regenerate
+    cache: FeatherCache|None = FeatherCache()
+
     def __init__(self, 
                  start_point: Point, 
                  EW: float, 
@@ -26,7 +43,10 @@ class FabulousFeather:
                  quill_speed: float = 100,
                  retraction: bool = False,
                  rachis_PA: float|None = None,
-                 vane_PA: float|None = None
+                 vane_PA: float|None = None,
+                 chordal_tolerance: float|None = None,
+                 min_segment_length: float = 0,
+                 continuous_rachis: bool = False
                  ) -> None:
         self.start_point = start_point
         self.EW = EW
@@ -49,101 +69,218 @@ class FabulousFeather:
         self.retraction = retraction
         self.rachis_PA = rachis_PA
         self.vane_PA = vane_PA
+        self.chordal_tolerance = chordal_tolerance
+        self.min_segment_length = min_segment_length
+        self.continuous_rachis = continuous_rachis
+
+    def parameters(self) -> dict:
+        '''return the parameters the feather was created with
+        '''
+        return {name: getattr(self, name) for name in signature(FabulousFeather.__init__).parameters if name != 'self'}
+
+    def replace(self, **changes) -> 'FabulousFeather':
+        '''return a copy of the feather with some parameters changed
+        '''
+        return FabulousFeather(**{**self.parameters(), **changes})
     
-    def planar_rachis_steps(self) -> list:
+    def _planar_rachis_layer(self, layer: int) -> StepBuilder:
+        '''geometry of a single rachis and quill layer, without speed
+        '''
+        # find x in an ellipse: x = a/b * sqrt(b^2 - y^2)
+        # use to get x for rachis_length (to get a rounded tip) and quill_width (to get rounded quill)
+        z=self.quill_EH+layer*self.quill_EH
+        round_rachis_length = self.rachis_length/(self.quill_height+self.quill_EH) * sqrt((self.quill_height+self.quill_EH)**2 - (z-self.quill_EH)**2)
+        
+        round_quill_width = (self.quill_width/2)/(self.quill_height+self.quill_EH) * sqrt((self.quill_height+self.quill_EH)**2 - (z-self.quill_EH)**2)*2
+        
+        rachis_steps = StepBuilder(label='rachis_layer_'+str(layer), retracted=self.retraction)
+        rachis_steps.set_geometry(height=self.quill_EH)
+
+        # travel to begin of rachis
+        rachis_steps.travel_to(0, 0, z+self.z_lift)
+        rachis_steps.travel_to(0, 0, z)
+        
+        rachis_steps.unretract()
+        
+        
+        # draw rachis layer
+        rachis_coordinates, rachis_widths = single_line_quill_rachis_arrayXY(Point(x=0, y=0, z=z), 
+                                                                             quill_length=self.quill_length+self.afterfeather_length, 
+                                                                             quill_width=round_quill_width, 
+                                                                             rachis_length=round_rachis_length,
+                                                                             max_extrusion_width=self.quill_width,
+                                                                             segments=int(self.rachis_length*4),
+                                                                             reverse=True,
+                                                                             tolerance=self.chordal_tolerance,
+                                                                             min_segment_length=self.min_segment_length
+                                                                             )
+        rachis_steps.append_points(rachis_coordinates, widths=rachis_widths)
+        # wipe nozzle
+        rachis_steps.wipe(self.wipe_distance)
+        
+        if self.retraction:
+            rachis_steps.retract()
+
+        # lift z
+        rachis_steps.z_lift(self.z_lift)
+        return rachis_steps
+
+    def iter_planar_rachis_layers(self) -> Iterator[StepBuffer]:
+        '''yield the rachis and quill one layer at a time
+        '''
         # generate rachis and quill
-        rachis_steps = []
-        rachis_steps.append(ExtrusionGeometry(height=self.quill_EH))
         rachis_layers = round(self.quill_height/self.quill_EH)
         for  layer in range(rachis_layers):
-            # find x in an ellipse: x = a/b * sqrt(b^2 - y^2)
-            # use to get x for rachis_length (to get a rounded tip) and quill_width (to get rounded quill)
-            z=self.quill_EH+layer*self.quill_EH
-            round_rachis_length = self.rachis_length/(self.quill_height+self.quill_EH) * sqrt((self.quill_height+self.quill_EH)**2 - (z-self.quill_EH)**2)
-            
-            round_quill_width = (self.quill_width/2)/(self.quill_height+self.quill_EH) * sqrt((self.quill_height+self.quill_EH)**2 - (z-self.quill_EH)**2)*2
-            
-            rachis_layer_steps = []
-            # travel to begin of rachis
-            rachis_steps.extend(travel_to(Point(x=0, 
-                                                y=0, 
-                                                z=z+self.z_lift
-                                                )
-                                          )
-                                )
-            rachis_steps.extend(travel_to(Point(x=0, 
-                                                y=0, 
-                                                z=z
-                                                )
-                                          )
-                                )
-            
-            if self.retraction:
-                rachis_layer_steps.append(PrinterCommand(id='unretract'))    
-            
-            
-            # draw rachis layer
-            rachis_layer_steps.extend(single_line_quill_rachisXY(Point(x=0, y=0, z=z), 
-                                                                 quill_length=self.quill_length+self.afterfeather_length, 
-                                                                 quill_width=round_quill_width, 
-                                                                 rachis_length=round_rachis_length,
-                                                                 max_extrusion_width=self.quill_width,
-                                                                 segments=int(self.rachis_length*4),
-                                                                 reverse=True
-                                                                 )
-                            )
-            # wipe nozzle
-            rachis_layer_steps.extend(travel_to(Point(x=rachis_layer_steps[-1].x+self.wipe_distance, 
-                                                      y=rachis_layer_steps[-1].y, 
-                                                      z=rachis_layer_steps[-1].z
-                                                      )
-                                                )
-                                      )
-            
-            if self.retraction:
-                rachis_layer_steps.append(PrinterCommand(id='retract'))
-
-            # lift z
-            rachis_layer_steps.extend(z_lift(rachis_layer_steps, self.z_lift))
+            rachis_steps, = self._component('rachis_layer', RACHIS_PARAMETERS, lambda: [self._planar_rachis_layer(layer)], layer)
+            yield self._with_settings(rachis_steps)
+
+    def planar_rachis_buffer(self) -> StepBuffer:
+        rachis_steps = StepBuffer()
+        for rachis_layer_steps in self.iter_planar_rachis_layers():
             rachis_steps.extend(rachis_layer_steps)
         return rachis_steps
     
-    def steps(self) -> list:
-        '''return steps for the feather
+    def planar_rachis_steps(self) -> list:
+        return self.planar_rachis_buffer().to_steps()
+
+    def _continuous_rachis(self) -> StepBuilder:
+        '''geometry of the rachis and quill as one continuous line, without speed
         '''
-        
-        steps = []
-        steps.append(ExtrusionGeometry(area_model='rectangle', width=self.EW, height=self.EH))
-        steps.append(Printer(print_speed=self.vane_speed))
-        if self.vane_PA is not None:
-            steps.append(set_linear_advance(self.vane_PA))
+        rachis_coordinates, rachis_extrude, rachis_widths = single_line_quill_rachis_array3D(Point(x=0, y=0, z=0),
+                                                                                             quill_length=self.quill_length,
+                                                                                             quill_width=self.quill_width,
+                                                                                             quill_height=self.quill_height,
+                                                                                             EH=self.quill_EH,
+                                                                                             rachis_length=self.rachis_length,
+                                                                                             afterfeather_length=self.afterfeather_length,
+                                                                                             max_extrusion_width=self.quill_width,
+                                                                                             segments=int(self.rachis_length*4),
+                                                                                             tolerance=self.chordal_tolerance,
+                                                                                             min_segment_length=self.min_segment_length
+                                                                                             )
+        rachis_steps = StepBuilder(label='rachis', retracted=self.retraction)
+        rachis_steps.set_geometry(height=self.quill_EH)
+
+        # travel to begin of rachis
+        x, y, z = rachis_coordinates[0]
+        rachis_steps.travel_to(x, y, z+self.z_lift)
+        rachis_steps.travel_to(x, y, z)
+
+        rachis_steps.unretract()
+
+        # draw all layers, stepping up at the end of each
+        rachis_steps.append_points(rachis_coordinates[1:], extrude=rachis_extrude[1:], widths=rachis_widths[1:])
+        # wipe nozzle
+        rachis_steps.wipe(self.wipe_distance)
 
-        # generate first half of afterfeather
+        if self.retraction:
+            rachis_steps.retract()
+
+        # lift z
+        rachis_steps.z_lift(self.z_lift)
+        return rachis_steps
+
+    def continuous_rachis_buffer(self) -> StepBuffer:
+        '''the rachis and quill as one continuous line, the layers alternate direction instead of each starting at the quill
+        '''
+        rachis_steps, = self._component('continuous_rachis', RACHIS_PARAMETERS, lambda: [self._continuous_rachis()])
+        return self._with_settings(rachis_steps)
+
+    def continuous_rachis_steps(self) -> list:
+        return self.continuous_rachis_buffer().to_steps()
+    
+    def _vane_buffer(self, label: str) -> StepBuilder:
+        steps = StepBuilder(label=label)
+        steps.set_geometry(width=self.EW, height=self.EH)
+        return steps
+
+    def _component(self, name: str, parameter_names: tuple, create, *arguments) -> list:
+        '''sections of a geometry component, taken from FabulousFeather.cache when it was generated before with the same parameters
+        '''
+        if self.cache is None:
+            return create()
+        return self.cache.get(component_key(name, {parameter: getattr(self, parameter) for parameter in parameter_names}, *arguments), create)
+
+    def _with_settings(self, section: StepBuilder) -> StepBuilder:
+        '''apply the parameters which don't change the geometry to a section: speed and pressure advance
+        '''
+        if section.label.startswith('rachis'):
+            section.set_speeds(self.quill_speed)
+            return section
+
+        section.set_speeds(self.vane_speed)
+        if section.label == 'prevane_afterfeather' and self.vane_PA is not None:
+            steps = self._vane_buffer(section.label)
+            steps.set_speed(self.vane_speed)
+            steps.manual_gcode(set_linear_advance(self.vane_PA).text)
+            steps.extend(section)
+            section = steps
+        if section.label == 'postvane_afterfeather' and self.rachis_PA is not None:
+            section.manual_gcode(set_linear_advance(self.rachis_PA).text)
+        return section
+
+    def iter_sections(self, stats: GenerationStats|None = None) -> Iterator[StepBuffer]:
+        '''yield the feather section by section: pre-vane afterfeather, vane, post-vane afterfeather and each rachis layer, or the continuous rachis.
+        Pass a GenerationStats to record time, steps, extrusion and travel length for every section and the placement
+        '''
+        placement = Vector(x=self.start_point.x, y=self.start_point.y)
+        sections = self._iter_local_sections()
+        if stats is not None:
+            sections = stats.timed(sections)
+
+        for section in sections:
+            if stats is None:
+                section.translate(placement)
+            else:
+                with stats.phase('placement', section):
+                    section.translate(placement)
+            yield section
+
+    def _iter_local_sections(self) -> Iterator[StepBuffer]:
+        '''yield the sections of the feather relative to its start_point
+        '''
+        # each section is generated when it is needed, so generation statistics are recorded per section
+        for name, create in (('prevane_afterfeather', self._prevane_afterfeather), ('vane', self._vane), ('postvane_afterfeather', self._postvane_afterfeather)):
+            section, = self._component(name, VANE_PARAMETERS, lambda: [create()])
+            yield self._with_settings(section)
+
+        if self.continuous_rachis:
+            yield self.continuous_rachis_buffer()
+        else:
+            yield from self.iter_planar_rachis_layers()
+
+    def _afterfeather_inner_geometry(self) -> np.ndarray:
+        '''coordinates where the barbs of the first half of the afterfeather meet the quill
+        '''
         afterfeather_count = floor(self.afterfeather_length/(self.EW+self.barb_spacing))
-        afterfeather_inner_geometry = []
-        for afterfeather_index in range(afterfeather_count):
-            afterfeather_inner_geometry.append(Point(x=self.quill_length+self.afterfeather_length%(self.EW+self.barb_spacing)+afterfeather_index*(self.EW+self.barb_spacing), 
-                                                    y=self.quill_width/2 - self.barb_quill_connection, 
-                                                    z=self.EH
-                                                    )
-                                            )
-            
-        afterfeather_outer_geometry = cartesian_ellipse_arcXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH), 
+        afterfeather_inner_geometry = np.empty((afterfeather_count, 3))
+        afterfeather_inner_geometry[:, 0] = self.quill_length+self.afterfeather_length%(self.EW+self.barb_spacing)+np.arange(afterfeather_count)*(self.EW+self.barb_spacing)
+        afterfeather_inner_geometry[:, 1] = self.quill_width/2 - self.barb_quill_connection
+        afterfeather_inner_geometry[:, 2] = self.EH
+        return afterfeather_inner_geometry
+
+    def _prevane_afterfeather(self) -> StepBuilder:
+        '''geometry of the first half of the afterfeather, without speed and pressure advance
+        '''
+        afterfeather_inner_geometry = self._afterfeather_inner_geometry()
+        afterfeather_outer_geometry = cartesian_ellipse_arc_arrayXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH), 
                                                     a=self.afterfeather_length + self.afterfeather_extent,
                                                     b=self.vane_width/2,
                                                     start_percentage=0.35,
                                                     end_percentage=0.5,
-                                                    segments=afterfeather_count
-                                                    )
-        afterfeather_outer_geometry.pop(-1)
+                                                    segments=len(afterfeather_inner_geometry)
+                                                    )[:-1]
 
-        prevane_afterfeather_steps = vaneXY(afterfeather_inner_geometry, afterfeather_outer_geometry)
-        steps.extend(prevane_afterfeather_steps)
+        steps = self._vane_buffer('prevane_afterfeather')
+        steps.append_barbs(vane_arrayXY(afterfeather_inner_geometry, afterfeather_outer_geometry))
+        return steps
 
-        # generate main vane
+    def _vane(self) -> StepBuilder:
+        '''geometry of the main vane, without speed and pressure advance
+        '''
         barb_count_per_side = floor(self.rachis_length/(self.EW+self.barb_spacing))
 
-        vane_outer_geometry = cartesian_ellipse_arcXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH), 
+        vane_outer_geometry = cartesian_ellipse_arc_arrayXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH), 
                                                         a=self.rachis_length + self.vane_rachis_extent,
                                                         b=self.vane_width/2,
                                                         start_percentage=0.5,
@@ -152,7 +289,7 @@ class FabulousFeather:
                                                         mirror=True
                                             )
 
-        vane_inner_geometry = cartesian_ellipse_arcXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH),
+        vane_inner_geometry = cartesian_ellipse_arc_arrayXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH),
                                                         a=self.rachis_length,
                                                         b=self.quill_width/2-self.barb_quill_connection,
                                                         start_percentage=0.5,
@@ -161,46 +298,68 @@ class FabulousFeather:
                                                         mirror=True
                                             )
 
-        steps.extend(vaneXY(start_geometry=vane_inner_geometry, end_geometry=vane_outer_geometry))
+        steps = self._vane_buffer('vane')
+        steps.append_barbs(vane_arrayXY(start_geometry=vane_inner_geometry, end_geometry=vane_outer_geometry))
+        return steps
 
-        # generate reflected part of afterfeather
-        reflected_afterfeather_inner_geometry = []
-        for afterfeather_index in range(afterfeather_count):
-            reflected_afterfeather_inner_geometry.append(Point(x=self.quill_length+self.afterfeather_length%(self.EW+self.barb_spacing)+afterfeather_index*(self.EW+self.barb_spacing), 
-                                                    y=-self.quill_width/2+self.barb_quill_connection, 
-                                                    z=self.EH
-                                                    )
-                                            )
-        reflected_afterfeather_inner_geometry.reverse()
+    def _postvane_afterfeather(self) -> StepBuilder:
+        '''geometry of the reflected part of the afterfeather, ending with a retraction and z-lift, without speed and pressure advance
+        '''
+        reflected_afterfeather_inner_geometry = self._afterfeather_inner_geometry()[::-1].copy()
+        reflected_afterfeather_inner_geometry[:, 1] = -self.quill_width/2+self.barb_quill_connection
 
-        reflected_afterfeather_outer_geometry = cartesian_ellipse_arcXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH), 
+        reflected_afterfeather_outer_geometry = cartesian_ellipse_arc_arrayXY(centre=Point(x=self.quill_length+self.afterfeather_length, y=0, z=self.EH), 
                                                     a=self.afterfeather_length + self.afterfeather_extent,
                                                     b=-self.vane_width/2,
                                                     start_percentage=0.35,
                                                     end_percentage=0.5,
-                                                    segments=afterfeather_count
-                                                    )
-        reflected_afterfeather_outer_geometry.pop(-1)
-        reflected_afterfeather_outer_geometry.reverse()
-
+                                                    segments=len(reflected_afterfeather_inner_geometry)
+                                                    )[-2::-1]
 
-        postvane_afterfeather_steps = vaneXY(reflected_afterfeather_inner_geometry, reflected_afterfeather_outer_geometry)
 
-        steps.extend(postvane_afterfeather_steps)
+        steps = self._vane_buffer('postvane_afterfeather')
+        steps.append_barbs(vane_arrayXY(reflected_afterfeather_inner_geometry, reflected_afterfeather_outer_geometry))
         
         if self.retraction:
-                steps.append(PrinterCommand(id='retract'))
+                steps.retract()
 
         # lift z
-        steps.extend(z_lift(steps, self.z_lift))
+        steps.z_lift(self.z_lift)
+        return steps
 
-        rachis_steps = self.planar_rachis_steps()
+    def step_buffer(self, stats: GenerationStats|None = None) -> StepBuffer:
+        '''return steps for the feather as a compact StepBuffer
+        '''
+        steps = StepBuffer()
+        for section in self.iter_sections(stats):
+            steps.extend(section)
+        return steps
+    
+    def steps(self, stats: GenerationStats|None = None) -> list:
+        '''return steps for the feather
+        '''
+        steps = self.step_buffer(stats)
+        if stats is None:
+            return steps.to_steps()
+        with stats.phase('to_steps', steps):
+            return steps.to_steps()
 
-        steps.append(Printer(print_speed=self.quill_speed))
-        if self.rachis_PA is not None:
-            steps.append(set_linear_advance(self.rachis_PA))
-        steps.extend(rachis_steps)
+    def iter_steps(self, stats: GenerationStats|None = None, arc_tolerance: float|None = None) -> Iterator:
+        '''lazily yield fullcontrol steps for the feather, section by section, for generating gcode. The rachis is
+        yielded as VariableWidthLines, use steps() for a list to move with fullcontrol's geometry functions.
+        With arc_tolerance (mm), curved runs of points are replaced by G2/G3 arcs
+        '''
+        steps = steps_from_buffers(self.iter_sections(stats), variable_width_lines=True)
+        return steps if arc_tolerance is None else iter_arcs(steps, arc_tolerance)
 
-        steps = move(steps, Vector(x=self.start_point.x, y=self.start_point.y))
-        
-        return steps
\ No newline at end of file
+    def write_gcode(self, file: TextIO, gcode_controls: GcodeControls|None = None, stats: GenerationStats|None = None, arc_tolerance: float|None = None) -> int:
+        '''stream gcode for the feather to an open text file without generating the whole design up front. Returns the number of lines written.
+        Without stats, and when FabulousFeather.cache keeps gcode, the gcode is taken from the cache when the same feather
+        was written with the same controls before
+        '''
+        if self.cache is None or not self.cache.gcode or stats is not None:
+            return write_gcode(self.iter_steps(stats, arc_tolerance), file, gcode_controls)
+
+        # the controls are hashed as passed in, generating the gcode initializes them like without the cache
+        key = component_key('gcode', self.parameters(), repr(gcode_controls), arc_tolerance)
+        return self.cache.write_text(key, file, lambda text: write_gcode(self.iter_steps(arc_tolerance=arc_tolerance), text, gcode_controls))
@@ -1,95 +1,180 @@
-from fullcontrol import Point, Extruder, ExtrusionGeometry, Vector, move, move_polar, Union, PrinterCommand, travel_to
-from math import cos, sin, pi, tau, sqrt, floor
+from fullcontrol import Point, Extruder, Vector, move_polar, Union
+from math import pi, tau, floor
+import numpy as np
 from z_lift import z_lift
+from variablewidthline import VariableWidthLine
+from stepbuffer import StepBuffer
+
+def points_from_array(coordinates: np.ndarray) -> list:
+    '''convert an (n, 3) array of XYZ coordinates to a list of Points
+    '''
+    return [Point(x=x, y=y, z=z) for x, y, z in np.asarray(coordinates, dtype=float).tolist()]
+
+def array_from_points(geometry: Union[np.ndarray, list]) -> np.ndarray:
+    '''convert a list of Points to an (n, 3) array of XYZ coordinates, arrays are passed through
+    '''
+    if isinstance(geometry, np.ndarray):
+        return geometry
+    return np.array([(point.x, point.y, point.z) for point in geometry], dtype=float).reshape(-1, 3)
+
+def vane_arrayXY(start_geometry: Union[np.ndarray, list], end_geometry: Union[np.ndarray, list], vector: Vector=Vector()) -> np.ndarray:
+    '''generate barbs as an (n, 2, 3) array of barb start and end coordinates
+    '''
+    start_coordinates = array_from_points(start_geometry)
+    end_coordinates = array_from_points(end_geometry)
+
+    if len(start_coordinates) != len(end_coordinates):
+        raise Exception("start_geometry and end_geometry don't have the same length")
+
+    barbs = np.stack((start_coordinates, end_coordinates), axis=1)
+    barbs += [vector.x or 0, vector.y or 0, vector.z or 0]
+
+    return barbs
 
 def vaneXY(start_geometry: Union[Point, list], end_geometry: Union[Point, list], vector: Vector=Vector()) -> list:
     '''generate barbs
     '''
     steps = []
 
-    if len(start_geometry) != len(end_geometry):
-        raise Exception("start_geometry and end_geometry don't have the same length")
-
-    for point_index in range(len(start_geometry)):
+    for start, end in vane_arrayXY(start_geometry, end_geometry, vector).tolist():
         steps.append(Extruder(on=False))
-        steps.append(start_geometry[point_index])
+        steps.append(Point(x=start[0], y=start[1], z=start[2]))
         steps.append(Extruder(on=True))
-        steps.append(end_geometry[point_index])
+        steps.append(Point(x=end[0], y=end[1], z=end[2]))
     
-    return move(steps, vector)
+    return steps
 
-def cartesian_ellipse_arcXY(centre: Point, a: float, b: float, start_percentage: float=0.0, end_percentage: float=1.0, segments: int=100, mirror: bool=False) -> list:
-    '''generate a partial ellipse, based on cartesian definition of an ellipse y = b/a * sqrt(a^2 - x^2). By default it will generate half an ellipse above the X-axis. 
+def _sqrt_checked(values: np.ndarray) -> np.ndarray:
+    '''square root which raises like math.sqrt when a point falls outside of the ellipse
     '''
-    steps = []
-    
-    for point_index in range(segments+1):
+    if np.any(values < 0):
+        raise Exception("math domain error, percentage outside of the ellipse")
+    return np.sqrt(values)
+
+def adaptive_parameters(curve, start: float, end: float, tolerance: float, min_segment_length: float=0.0, initial_segments: int=4,
+                        max_y_step: float|None=None) -> np.ndarray:
+    '''parameter values from start to end for a curve, which maps an array of parameters to an (n, 2) array of XY coordinates.
+    Segments are split until the curve deviates less than tolerance from each chord, so points are placed by curvature.
+    With max_y_step, segments that change Y by more than max_y_step are split as well.
+    Segments shorter than twice min_segment_length are not split
+    '''
+    if tolerance <= 0:
+        raise Exception("tolerance must be greater than 0")
+
+    parameters = np.linspace(start, end, initial_segments+1)
+    for _ in range(64):
+        points = curve(parameters)
+        middle_parameters = (parameters[:-1]+parameters[1:])/2
+        chords = np.diff(points, axis=0)
+        chord_lengths = np.linalg.norm(chords, axis=1)
+        # distance from the curve halfway along the segment to the chord
+        offsets = curve(middle_parameters) - points[:-1]
+        deviations = np.abs(chords[:, 0]*offsets[:, 1] - chords[:, 1]*offsets[:, 0])/np.maximum(chord_lengths, 1e-12)
+        split = deviations > tolerance
+        if max_y_step is not None:
+            split |= np.abs(chords[:, 1]) > max_y_step
+        split &= chord_lengths > 2*min_segment_length
+        if not np.any(split):
+            break
+        parameters = np.insert(parameters, np.flatnonzero(split)+1, middle_parameters[split])
+
+    return parameters
+
+def cartesian_ellipse_arc_arrayXY(centre: Point, a: float, b: float, start_percentage: float=0.0, end_percentage: float=1.0, segments: int=100, mirror: bool=False,
+                                  tolerance: float|None=None, min_segment_length: float=0.0, max_y_step: float|None=None) -> np.ndarray:
+    '''generate a partial ellipse as an (n, 3) array, based on cartesian definition of an ellipse y = b/a * sqrt(a^2 - x^2). By default it will generate half an ellipse above the X-axis. 
+    With a tolerance, segments is ignored and points are placed so the chordal deviation stays below tolerance,
+    and the change in Y between points below max_y_step when it is given
+    '''
+    if tolerance is None:
+        point_index = np.arange(segments+1, dtype=float)
         x = (end_percentage-start_percentage)*2*a*point_index/segments - a + (start_percentage*2*a)
-        #print(x)
-        steps.append(Point(x=x + centre.x, 
-                           y=b/a * sqrt(a**2 - x**2) + centre.y, 
-                           z=centre.z
-                           )
-                    )
-    
+    else:
+        x = adaptive_parameters(lambda x: np.stack((x, b/a * np.sqrt(np.maximum(a**2 - x**2, 0))), axis=1),
+                                start_percentage*2*a - a,
+                                end_percentage*2*a - a,
+                                tolerance,
+                                min_segment_length,
+                                max_y_step=max_y_step
+                                )
+    xs = [x]
+    ys = [b/a * _sqrt_checked(a**2 - x**2)]
+
     if mirror:
-        for point_index in range(1, segments+1):
-            x = (start_percentage-end_percentage)*2*a*point_index/segments - a + (end_percentage*2*a)
-            #print(x)
-            steps.append(Point(x=x + centre.x, 
-                            y=-b/a * sqrt(a**2 - x**2) + centre.y, 
-                            z=centre.z
-                            )
-                        )
+        if tolerance is None:
+            x = (start_percentage-end_percentage)*2*a*point_index[1:]/segments - a + (end_percentage*2*a)
+        else:
+            x = x[-2::-1]
+        xs.append(x)
+        ys.append(-b/a * _sqrt_checked(a**2 - x**2))
 
-    return steps
+    x = np.concatenate(xs)
+    coordinates = np.empty((len(x), 3))
+    coordinates[:, 0] = x + centre.x
+    coordinates[:, 1] = np.concatenate(ys) + centre.y
+    coordinates[:, 2] = centre.z
+
+    return coordinates
+
+def cartesian_ellipse_arcXY(centre: Point, a: float, b: float, start_percentage: float=0.0, end_percentage: float=1.0, segments: int=100, mirror: bool=False,
+                            tolerance: float|None=None, min_segment_length: float=0.0) -> list:
+    '''generate a partial ellipse, based on cartesian definition of an ellipse y = b/a * sqrt(a^2 - x^2). By default it will generate half an ellipse above the X-axis. 
+    '''
+    return points_from_array(cartesian_ellipse_arc_arrayXY(centre, a, b, start_percentage, end_percentage, segments, mirror, tolerance, min_segment_length))
 
 def cartesian_ellipse_arcXYpolar(centre: Point, direction_polar: float, a: float, b: float, start_percentage: float=0.0, end_percentage: float=1.0, segments: int=100) -> list:
     steps = []
     steps.extend(cartesian_ellipse_arcXY(centre, a, b, start_percentage, end_percentage, segments))
     return move_polar(steps, centre, 0, direction_polar)
 
-def cartesian_ellipseXY(centre: Point, a: float, b: float, segments: int=100, cw: bool=True) -> list:
+def cartesian_ellipse_arrayXY(centre: Point, a: float, b: float, segments: int=100, cw: bool=True, tolerance: float|None=None, min_segment_length: float=0.0) -> np.ndarray:
+    '''generate an ellipse as an (n, 3) array, based on cartesian definition of an ellipse using y = b/a * sqrt(a^2 - x^2)
+    '''
+    if not(cw):
+        b = -b
+
+    half_ellipse = cartesian_ellipse_arc_arrayXY(centre, a, b, 0.0, 1.0, segments, tolerance=tolerance, min_segment_length=min_segment_length)
+    return np.concatenate((half_ellipse[:-1], cartesian_ellipse_arc_arrayXY(centre, a, -b, 1.0, 0.0, segments, tolerance=tolerance, min_segment_length=min_segment_length)))
+
+def cartesian_ellipseXY(centre: Point, a: float, b: float, segments: int=100, cw: bool=True, tolerance: float|None=None, min_segment_length: float=0.0) -> list:
     '''generate an ellipse, based on cartesian definition of an ellipse using y = b/a * sqrt(a^2 - x^2)
     '''
-    steps = []
+    return points_from_array(cartesian_ellipse_arrayXY(centre, a, b, segments, cw, tolerance, min_segment_length))
 
-    if cw:
-        half_ellipse_steps = cartesian_ellipse_arcXY(centre, a, b, 0.0, 1.0, segments)
-        half_ellipse_steps.pop(-1)
-        steps.extend(half_ellipse_steps)
-        steps.extend(cartesian_ellipse_arcXY(centre, a, -b, 1.0, 0.0, segments))
-    
+def ellipse_arc_arrayXY(centre: Point, a: float, b: float, start_angle: float, arc_angle: float, segments: int=100,
+                        tolerance: float|None=None, min_segment_length: float=0.0) -> np.ndarray:
+    '''generate a partial ellipse as an (n, 3) array based on trigonometric definition of an ellipse x = a*cos(t), y = b*sin(t)
+    With a tolerance, segments is ignored and points are placed so the chordal deviation stays below tolerance
+    '''
+    if tolerance is None:
+        angle_increment = arc_angle/(segments)
+        t = start_angle + np.arange(segments+1)*angle_increment
     else:
-        half_ellipse_steps = cartesian_ellipse_arcXY(centre, a, -b, 0.0, 1.0, segments)
-        half_ellipse_steps.pop(-1)
-        steps.extend(half_ellipse_steps)
-        steps.extend(cartesian_ellipse_arcXY(centre, a, b, 1.0, 0.0, segments))
+        t = adaptive_parameters(lambda t: np.stack((a*np.cos(t), b*np.sin(t)), axis=1), start_angle, start_angle+arc_angle, tolerance, min_segment_length)
 
-    return steps
+    coordinates = np.empty((len(t), 3))
+    coordinates[:, 0] = a*np.cos(t) + centre.x
+    coordinates[:, 1] = b*np.sin(t) + centre.y
+    coordinates[:, 2] = centre.z
+
+    return coordinates
 
-def ellipse_arcXY(centre: Point, a: float, b: float, start_angle: float, arc_angle: float, segments: int=100) -> list:
+def ellipse_arcXY(centre: Point, a: float, b: float, start_angle: float, arc_angle: float, segments: int=100,
+                  tolerance: float|None=None, min_segment_length: float=0.0) -> list:
     '''generate a partial ellipse based on trigonometric definition of an ellipse x = a*cos(t), y = b*sin(t), by default it will have 100 segments
     '''
-    steps = []
-    angle_increment = arc_angle/(segments)
-
-    for point_index in range(segments+1):
-        t = start_angle + point_index*angle_increment
-        steps.append(Point(x=a*cos(t) + centre.x, y=b*sin(t) + centre.y, z=centre.z))
+    return points_from_array(ellipse_arc_arrayXY(centre, a, b, start_angle, arc_angle, segments, tolerance, min_segment_length))
 
-    return steps
-
-def ellipseXY(centre: Point, a: float, b: float, start_angle: float, segments: int=100, cw: bool=False) -> list:
+def ellipseXY(centre: Point, a: float, b: float, start_angle: float, segments: int=100, cw: bool=False, tolerance: float|None=None, min_segment_length: float=0.0) -> list:
     '''generate an ellipse based on trigonometric definition of an ellipse x = a*cos(t), y = b*sin(t), by default it will have 100 segments and be drawn counter-clockwise
     '''
     steps = []
 
     if not(cw):
-        steps = ellipse_arcXY(centre, a, b, start_angle, start_angle + tau, segments)
+        steps = ellipse_arcXY(centre, a, b, start_angle, start_angle + tau, segments, tolerance, min_segment_length)
     
     else:
-        steps = ellipse_arcXY(centre, a, b, start_angle, start_angle - tau, segments)
+        steps = ellipse_arcXY(centre, a, b, start_angle, start_angle - tau, segments, tolerance, min_segment_length)
 
     return steps
 
@@ -140,6 +225,56 @@ def quill_rachisXY(start_point: Point, quill_length: float, quill_width: float,
     
     return steps
 
+def single_line_quill_rachis_arrayXY(
+    start_point: Point, 
+    quill_length: float, 
+    quill_width: float, 
+    rachis_length: float, 
+    max_extrusion_width: float=1.0, 
+    segments: int=100,
+    reverse: bool=True,
+    tolerance: float|None=None,
+    min_segment_length: float=0.0
+    ) -> tuple:
+    '''generate a single line layer quill + rachis as an (n, 3) array of points and an array of the extrusion width of the line ending at each point
+    '''
+    if quill_width > max_extrusion_width:
+        raise Exception("quill_width exceeds max_extrusion_width, decrease quill_width. If 3d printer is capable of extruding wider lines, increase max_extrusion_width accordingly")
+    
+    perimeter_geometry = cartesian_ellipse_arc_arrayXY(Point(x=0, y=0, z=0),
+                                                       a=rachis_length,
+                                                       b=quill_width/2,
+                                                       start_percentage=1.0,
+                                                       end_percentage=0.5,
+                                                       segments=segments,
+                                                       tolerance=tolerance,
+                                                       min_segment_length=min_segment_length,
+                                                       # every segment is extruded at the width of its end, 2*y
+                                                       max_y_step=None if tolerance is None else tolerance/2
+                                                       )
+
+    if reverse:
+        perimeter_geometry = perimeter_geometry[::-1]
+
+    coordinates = np.empty((len(perimeter_geometry)+1, 3))
+    coordinates[:, 1] = start_point.y
+    coordinates[:, 2] = start_point.z
+    widths = np.empty(len(perimeter_geometry)+1)
+
+    if reverse:
+        coordinates[0, 0] = start_point.x
+        coordinates[1:, 0] = perimeter_geometry[:, 0]+start_point.x+quill_length
+        widths[1:] = 2*perimeter_geometry[:, 1]
+        widths[0] = widths[1]
+    
+    else:
+        coordinates[:-1, 0] = perimeter_geometry[:, 0]+start_point.x+quill_length
+        coordinates[-1, 0] = start_point.x
+        widths[:-1] = 2*perimeter_geometry[:, 1]
+        widths[-1] = widths[-2]
+
+    return coordinates, widths
+
 def single_line_quill_rachisXY(
     start_point: Point, 
     quill_length: float, 
@@ -147,47 +282,89 @@ def single_line_quill_rachisXY(
     rachis_length: float, 
     max_extrusion_width: float=1.0, 
     segments: int=100,
-    reverse: bool=True
+    reverse: bool=True,
+    tolerance: float|None=None,
+    min_segment_length: float=0.0,
+    variable_width_line: bool=False
     ) -> list:
-    '''generate steps for printing a single line layer quill + rachis, width varying extrusion width
+    '''generate steps for printing a single line layer quill + rachis, width varying extrusion width.
+    With variable_width_line, the varying width part is a single VariableWidthLine instead of an ExtrusionGeometry and Point
+    per point, which is faster to turn into gcode but is not moved by fullcontrol's move() and move_polar()
     '''
     steps = []
 
-    if quill_width > max_extrusion_width:
-        raise Exception("quill_width exceeds max_extrusion_width, decrease quill_width. If 3d printer is capable of extruding wider lines, increase max_extrusion_width accordingly")
-    
-    perimeter_geometry = cartesian_ellipse_arcXY(Point(x=0, y=0, z=0),
-                                                 a=rachis_length,
-                                                 b=quill_width/2,
-                                                 start_percentage=1.0,
-                                                 end_percentage=0.5,
-                                                 segments=segments
-                                                 )
+    coordinates, widths = single_line_quill_rachis_arrayXY(start_point, quill_length, quill_width, rachis_length, max_extrusion_width, segments, reverse,
+                                                           tolerance, min_segment_length)
 
     if reverse:
+        line = VariableWidthLine(coordinates[1:], widths[1:])
         steps.append(Point(x=start_point.x, y=start_point.y, z=start_point.z))
-        for point in reversed(perimeter_geometry):
-            #print("extrusion width=", str(2*point.y))
-            steps.append(ExtrusionGeometry(width=2*point.y))
-            steps.append(Point(x=point.x+start_point.x+quill_length,
-                            y=start_point.y,
-                            z=start_point.z
-                            )
-                        )
+        steps.extend([line] if variable_width_line else line.steps())
     
     else:
-        for point in perimeter_geometry:
-            #print("extrusion width=", str(2*point.y))
-            steps.append(ExtrusionGeometry(width=2*point.y))
-            steps.append(Point(x=point.x+start_point.x+quill_length,
-                            y=start_point.y,
-                            z=start_point.z
-                            )
-                        )
+        line = VariableWidthLine(coordinates[:-1], widths[:-1])
+        steps.extend([line] if variable_width_line else line.steps())
         steps.append(Point(x=start_point.x, y=start_point.y, z=start_point.z))
 
     return steps
 
+def single_line_quill_rachis_array3D(
+    start_point: Point, 
+    quill_length: float, 
+    quill_width: float, 
+    quill_height: float,
+    EH: float,
+    rachis_length: float, 
+    afterfeather_length: float = 0,
+    max_extrusion_width: float=1.0, 
+    segments: int=100,
+    tolerance: float|None=None,
+    min_segment_length: float=0.0
+    ) -> tuple:
+    '''generate a continuous multi layer single line quill + rachis as an (n, 3) array of points, an array of whether the move to
+    each point extrudes and an array of the extrusion width of the line ending at each point. Layers alternate direction, so
+    every layer starts where the previous one ended after a step up, without travelling back to the quill. Every layer is the
+    profile of the first layer scaled down to give the rachis a rounded cross section. The first point is the start of the
+    first layer, to be travelled to
+    '''
+    if quill_width > max_extrusion_width:
+        raise Exception("quill_width exceeds max_extrusion_width, decrease quill_width. If 3d printer is capable of extruding wider lines, increase max_extrusion_width accordingly")
+
+    rachis_start = quill_length+afterfeather_length
+    profile, profile_widths = single_line_quill_rachis_arrayXY(Point(x=0, y=0, z=0), rachis_start, quill_width, rachis_length, max_extrusion_width, segments,
+                                                               reverse=True, tolerance=tolerance, min_segment_length=min_segment_length)
+
+    # find the scale of each layer in an ellipse: x = a/b * sqrt(b^2 - y^2), for a rounded tip and quill
+    layer_index = np.arange(round(quill_height/EH))
+    z = start_point.z+EH+layer_index*EH
+    scales = np.sqrt(1 - (layer_index*EH/(quill_height+EH))**2)
+
+    # (layers, points) arrays: the rachis is scaled about its start, the start of the quill stays in place
+    x = np.where(np.arange(len(profile)) == 0, profile[0, 0], rachis_start+(profile[:, 0]-rachis_start)*scales[:, None])
+    widths = profile_widths*scales[:, None]
+    # odd layers run from the tip back to the quill, each line keeps the width it has when printed forwards
+    x[1::2] = x[1::2, ::-1]
+    widths[1::2] = np.concatenate((widths[1::2, 1:], widths[1::2, -1:]), axis=1)[:, ::-1]
+
+    # before each layer, step up from the end of the previous layer
+    layer_x = np.empty((len(layer_index), len(profile)+1))
+    layer_x[:, 0] = np.concatenate(([x[0, 0]], x[:-1, -1]))
+    layer_x[:, 1:] = x
+    layer_widths = np.empty_like(layer_x)
+    layer_widths[:, 0] = widths[:, 0]
+    layer_widths[:, 1:] = widths
+    extrude = np.ones(layer_x.shape, dtype=bool)
+    extrude[:, :2] = False
+
+    coordinates = np.empty((layer_x.size, 3))
+    coordinates[:, 0] = layer_x.ravel()+start_point.x
+    coordinates[:, 1] = start_point.y
+    coordinates[:, 2] = np.repeat(z, layer_x.shape[1])
+
+    # at the quill end the step up already reaches the start of the next layer
+    keep = np.concatenate(([True], np.any(coordinates[1:] != coordinates[:-1], axis=1)))
+    return coordinates[keep], extrude.ravel()[keep], layer_widths.ravel()[keep]
+
 def single_line_quill_rachis3D(
     start_point: Point, 
     quill_length: float, 
@@ -198,56 +375,18 @@ def single_line_quill_rachis3D(
     afterfeather_length: float = 0,
     max_extrusion_width: float=1.0, 
     segments: int=100,
-    z_lift: float = 0
+    z_lift: float = 0,
+    tolerance: float|None=None,
+    min_segment_length: float=0.0
     ) -> list:
-    '''[WORK IN PROGRESS] 3D single line quill + rachis 
+    '''generate steps for printing a continuous multi layer single line quill + rachis, approached from z_lift above the first layer.
+    See single_line_quill_rachis_array3D
     '''
-    
-    # generate rachis and quill
-    rachis_steps = []
-    rachis_steps.append(ExtrusionGeometry(height=EH))
-    
-        # travel to begin of rachis
-    rachis_steps.extend(travel_to(Point(x=quill_length+afterfeather_length+rachis_length, 
-                                        y=0, 
-                                        z=start_point.z+z_lift
-                                        )
-                                    )
-                        )
-    rachis_steps.extend(travel_to(Point(x=quill_length+afterfeather_length+rachis_length, 
-                                        y=0, 
-                                        z=start_point.z
-                                        )
-                                    )
-                        )
-    
-    for  layer in range(segments):
-        # find x in an ellipse: x = a/b * sqrt(b^2 - y^2)
-        # use to get x for rachis_length (to get a rounded tip) and quill_width (to get rounded quill)
-        z=quill_height*layer/(segments)
-        x = rachis_length/(quill_height) * sqrt((quill_height)**2 - z**2)
-        
-        #print('height: '+ str(z))
-    
-        if quill_width > max_extrusion_width:
-            raise Exception("quill_width exceeds max_extrusion_width, decrease quill_width. If 3d printer is capable of extruding wider lines, increase max_extrusion_width accordingly")
-
-        perimeter_geometry = cartesian_ellipse_arcXY(Point(x=0, y=0, z=0),
-                                                a=rachis_length,
-                                                b=quill_width/2,
-                                                start_percentage=1.0,
-                                                end_percentage=0.5,
-                                                segments=segments
-                                                )
-
-        for point in perimeter_geometry:
-            rachis_steps.append(ExtrusionGeometry(width=2*point.y, height=z))
-            rachis_steps.append(Point(x=start_point.x+quill_length+x,
-                                y=start_point.y,
-                                z=start_point.z+EH+z
-                                )
-                        )
-
-            rachis_steps.append(Point(x=start_point.x, y=start_point.y, z=start_point.z))
-    return rachis_steps
-    
\ No newline at end of file
+    coordinates, extrude, widths = single_line_quill_rachis_array3D(start_point, quill_length, quill_width, quill_height, EH, rachis_length, afterfeather_length,
+                                                                    max_extrusion_width, segments, tolerance, min_segment_length)
+    rachis_steps = StepBuffer()
+    rachis_steps.set_geometry(height=EH)
+    x, y, z = coordinates[0]
+    rachis_steps.travel_to(x, y, z+z_lift)
+    rachis_steps.append_points(coordinates, extrude, widths)
+    return rachis_steps.to_steps()
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Callable, TextIO
+import json
+import os
+import numpy as np
+from stepbuilder import StepBuilder
+
+# the output depends on the code in these modules, so stored components are invalidated when they change
+CODE_MODULES = ('fabulousfeathers.py', 'fabuloushelpers.py', 'stepbuffer.py', 'stepbuilder.py', 'variablewidthline.py', 'arcfitting.py', 'gcodestream.py')
+
+def component_key(name: str, parameters: dict, *arguments) -> str:
+    '''content address of a geometry component: a hash of its name, the parameters it depends on and any extra arguments
+    '''
+    description = json.dumps([name, sorted(parameters.items()), arguments], default=repr)
+    return sha256(description.encode()).hexdigest()
+
+class FeatherCache:
+    '''size-bounded least recently used cache of generated geometry components, each a list of StepBuffers in local
+    coordinates. With gcode, complete gcode is kept as well, off by default since it takes several MB per feather.
+    With a directory, entries are also stored on disk as .npz and .gcode files, so they survive restarts and can be
+    shared between processes. Components are copied on the way out, so callers can modify them.
+    '''
+    def __init__(self, max_bytes: int = 64*2**20, directory: str|None = None, gcode: bool = False) -> None:
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.gcode = gcode
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._components = OrderedDict()
+        self._code_version = None
+
+    def __len__(self) -> int:
+        return len(self._components)
+
+    def clear(self) -> None:
+        '''empty the in-memory cache, stored components on disk are kept
+        '''
+        self._components.clear()
+        self.nbytes = 0
+
+    def get(self, key: str, create: Callable[[], list]) -> list:
+        '''copies of the sections stored under key, created with create() when they are not cached yet
+        '''
+        if key in self._components:
+            self._components.move_to_end(key)
+            self.hits += 1
+        else:
+            sections = self._load(key) if self.directory is not None else None
+            if sections is None:
+                self.misses += 1
+                sections = create()
+                if self.directory is not None:
+                    self._store(key, sections)
+            else:
+                self.hits += 1
+            self._add(key, sections)
+        return [section.copy() for section in self._components[key]]
+
+    def write_text(self, key: str, file: TextIO, write: Callable[[TextIO], int]) -> int:
+        '''write the gcode stored under key to an open text file and return its number of lines. When it is not cached yet,
+        write(file) streams it to the file and returns the number of lines, and a copy is stored on the way
+        '''
+        if key in self._components:
+            self._components.move_to_end(key)
+            self.hits += 1
+            text = self._components[key]
+            file.write(text)
+            return text.count('\n')
+
+        path = self._path(key, '.gcode') if self.directory is not None else None
+        if path is not None and os.path.exists(path):
+            self.hits += 1
+            with open(path) as stored:
+                text = stored.read()
+            file.write(text)
+            line_count = text.count('\n')
+        else:
+            self.misses += 1
+            copy = _TextCopy(file)
+            line_count = write(copy)
+            text = ''.join(copy.parts)
+            if path is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path + '.part', 'w') as stored:
+                    stored.write(text)
+                os.replace(path + '.part', path)
+        self._add(key, text)
+        return line_count
+
+    def _add(self, key: str, value: list|str) -> None:
+        self._components[key] = value
+        self.nbytes += _size(value)
+        while self.nbytes > self.max_bytes and len(self._components) > 1:
+            _, removed = self._components.popitem(last=False)
+            self.nbytes -= _size(removed)
+
+    def _path(self, key: str, extension: str = '.npz') -> str:
+        if self._code_version is None:
+            code_hash = sha256()
+            for module in CODE_MODULES:
+                with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), 'rb') as file:
+                    code_hash.update(file.read())
+            self._code_version = code_hash.hexdigest()[:16]
+        return os.path.join(self.directory, f'{self._code_version}_{key}{extension}')
+
+    def _load(self, key: str) -> list|None:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as stored:
+            descriptions = json.loads(str(stored['sections']))
+            sections = []
+            for index, description in enumerate(descriptions):
+                section = StepBuilder.from_rows(stored[f'rows_{index}'], description['texts'], description['label'])
+                section.retracted = description['retracted']
+                section.set_geometry(description['width'], description['height'])
+                section.speed = description['speed']
+                sections.append(section)
+        return sections
+
+    def _store(self, key: str, sections: list) -> None:
+        '''write the sections to a temporary file first, so other processes never read a partial component
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        descriptions = [{'label': section.label,
+                         'texts': section.texts,
+                         'retracted': getattr(section, 'retracted', False),
+                         'width': _optional(section.width),
+                         'height': _optional(section.height),
+                         'speed': section.speed
+                         } for section in sections]
+        path = self._path(key)
+        with open(path + '.part', 'wb') as file:
+            np.savez(file, sections=np.array(json.dumps(descriptions)), **{f'rows_{index}': section.rows for index, section in enumerate(sections)})
+        os.replace(path + '.part', path)
+
+class _TextCopy:
+    '''text file which passes everything written to it on to file and keeps a copy
+    '''
+    def __init__(self, file: TextIO) -> None:
+        self.file = file
+        self.parts = []
+
+    def write(self, text: str) -> None:
+        self.file.write(text)
+        self.parts.append(text)
+
+def _size(value: list|str) -> int:
+    return len(value) if type(value) == str else sum(section.nbytes for section in value)
+
+def _optional(value: float) -> float|None:
+    return None if np.isnan(value) else float(value)
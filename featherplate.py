@@ -0,0 +1,105 @@
+from fullcontrol import Point, Vector, GcodeControls
+from typing import Iterator, TextIO
+from fabulousfeathers import FabulousFeather
+from stepbuffer import StepBuffer, steps_from_buffers
+from gcodestream import write_gcode
+from arcfitting import iter_arcs
+
+class FeatherPlate:
+    '''a build plate with many feathers. Every distinct feather design is generated once in local coordinates
+    and placed on the plate while the steps are emitted, so generation scales with the number of designs
+    rather than the number of feathers.
+    '''
+    def __init__(self) -> None:
+        self.designs = []
+        self.instances = []
+        self._design_indices = {}
+        self._sections = {}
+
+    def __len__(self) -> int:
+        return len(self.instances)
+
+    def add(self, feather: FabulousFeather, x: float|None = None, y: float|None = None, **variations) -> None:
+        '''place a feather with its start_point at x, y (defaults to the feather's own start_point), optionally with some of its parameters changed
+        '''
+        if variations:
+            feather = feather.replace(**variations)
+        x = feather.start_point.x if x is None else x
+        y = feather.start_point.y if y is None else y
+
+        design = feather.replace(start_point=Point(x=0, y=0, z=0))
+        key = design_key(design)
+        if key not in self._design_indices:
+            self._design_indices[key] = len(self.designs)
+            self.designs.append(design)
+        self.instances.append((self._design_indices[key], x, y))
+
+    @classmethod
+    def grid(cls, feather: FabulousFeather, x_feathers: int, y_feathers: int, feather_spacing: float, variations: list|None = None) -> 'FeatherPlate':
+        '''lay out x_feathers by y_feathers copies of feather from its start_point, like fc.move(copy=True) in the batch print notebook.
+        variations is an optional list with a dict of changed parameters for every feather, in print order
+        '''
+        if variations is not None and len(variations) != x_feathers*y_feathers:
+            raise Exception("variations must contain one dict of parameters for every feather on the plate")
+
+        plate = cls()
+        x_pitch = feather.rachis_length+feather.afterfeather_length+feather.quill_length+feather_spacing
+        y_pitch = feather.vane_width+feather_spacing
+        for y_index in range(y_feathers):
+            for x_index in range(x_feathers):
+                plate.add(feather,
+                          x=feather.start_point.x+x_index*x_pitch,
+                          y=feather.start_point.y+y_index*y_pitch,
+                          **(variations[y_index*x_feathers+x_index] if variations is not None else {})
+                          )
+        return plate
+
+    def design_sections(self, design_index: int) -> list:
+        '''sections of a design in local coordinates, generated on first use
+        '''
+        if design_index not in self._sections:
+            self._sections[design_index] = list(self.designs[design_index].iter_sections())
+        return self._sections[design_index]
+
+    def iter_feathers(self) -> Iterator[list]:
+        '''yield the sections of each feather on the plate in print order, placed at their position
+        '''
+        for design_index, x, y in self.instances:
+            placed_sections = []
+            for section in self.design_sections(design_index):
+                placed_section = section.copy()
+                placed_section.translate(Vector(x=x, y=y))
+                placed_sections.append(placed_section)
+            yield placed_sections
+
+    def iter_sections(self) -> Iterator[StepBuffer]:
+        '''yield the sections of every feather on the plate in print order, placed at their position
+        '''
+        for placed_sections in self.iter_feathers():
+            yield from placed_sections
+
+    def step_buffer(self) -> StepBuffer:
+        steps = StepBuffer()
+        for section in self.iter_sections():
+            steps.extend(section)
+        return steps
+
+    def steps(self) -> list:
+        '''return steps for the whole plate
+        '''
+        return self.step_buffer().to_steps()
+
+    def iter_steps(self, arc_tolerance: float|None = None) -> Iterator:
+        steps = steps_from_buffers(self.iter_sections(), variable_width_lines=True)
+        return steps if arc_tolerance is None else iter_arcs(steps, arc_tolerance)
+
+    def write_gcode(self, file: TextIO, gcode_controls: GcodeControls|None = None, arc_tolerance: float|None = None) -> int:
+        '''stream gcode for the whole plate to an open text file. Returns the number of lines written.
+        With arc_tolerance (mm), curved runs of points are written as G2/G3 arcs
+        '''
+        return write_gcode(self.iter_steps(arc_tolerance), file, gcode_controls)
+
+def design_key(feather: FabulousFeather) -> tuple:
+    '''hashable key of all parameters of a feather except its placement
+    '''
+    return tuple((name, value) for name, value in sorted(feather.parameters().items()) if name != 'start_point')
@@ -0,0 +1,54 @@
+from fullcontrol import Point, GcodeControls
+from fullcontrol.gcode.state import State
+from fullcontrol.gcode.tips import tips
+from itertools import chain
+from typing import Iterable, Iterator, TextIO
+
+def iter_gcode(steps: Iterable, gcode_controls: GcodeControls|None = None, show_tips: bool = False) -> Iterator[str]:
+    '''generate lines of gcode from an iterable of fullcontrol steps, equivalent to fc.transform(steps, 'gcode', gcode_controls)
+    without materializing the steps or the gcode. Only the last generated line is held back, since a GcodeComment may append to it.
+    '''
+    if gcode_controls is None:
+        gcode_controls = GcodeControls()
+    gcode_controls.initialize()
+    if show_tips:
+        tips(gcode_controls)
+
+    # the primer of the printer needs the first point of the design, so read steps up to and including it
+    steps = iter(steps)
+    design_start = []
+    for step in steps:
+        design_start.append(step)
+        if isinstance(step, Point):
+            break
+
+    state = State(design_start, gcode_controls)
+    design_index = next(index for index, step in enumerate(state.steps) if step is design_start[0])
+    starting_procedure_steps = state.steps[:design_index]
+    ending_procedure_steps = state.steps[design_index+len(design_start):]
+    state.gcode = []
+
+    for step in chain(starting_procedure_steps, design_start, steps, ending_procedure_steps):
+        # steps may insert more steps into state.steps, like in fullcontrol's own gcode loop
+        state.steps = [step]
+        state.i = 0
+        while state.i < len(state.steps):
+            gcode_line = state.steps[state.i].gcode(state)
+            if gcode_line != None:
+                state.gcode.append(gcode_line)
+            state.i += 1
+        if len(state.gcode) > 1:
+            yield from state.gcode[:-1]
+            del state.gcode[:-1]
+
+    yield from state.gcode
+
+def write_gcode(steps: Iterable, file: TextIO, gcode_controls: GcodeControls|None = None, show_tips: bool = False) -> int:
+    '''stream gcode for an iterable of fullcontrol steps to an open text file, line by line. Returns the number of lines written
+    '''
+    line_count = 0
+    for gcode_line in iter_gcode(steps, gcode_controls, show_tips):
+        file.write(gcode_line + '\n')
+        # a single step, like a VariableWidthLine, may produce several lines
+        line_count += gcode_line.count('\n') + 1
+    return line_count
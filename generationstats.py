@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+import numpy as np
+from stepbuffer import StepBuffer, MOVE
+
+class GenerationStats:
+    '''collects time, number of steps, extrusion length and travel length for each phase of generating a design.
+    Pass it to FabulousFeather.steps(), step_buffer(), iter_sections() or write_gcode(), then print it or read phases.
+    Phases with the same name, like the placement of every section, are added up.
+    The optional callback is called with the measurement of every phase as soon as it is finished.
+    '''
+    def __init__(self, callback: Callable[[dict], None]|None = None) -> None:
+        self.callback = callback
+        self.phases = {}
+        self._sections = set()
+        self._position = None
+
+    def _add(self, name: str, seconds: float, steps: int = 0, extrusion_length: float = 0.0, travel_length: float = 0.0) -> None:
+        measurement = {'phase': name,
+                       'seconds': seconds,
+                       'steps': steps,
+                       'extrusion_length': extrusion_length,
+                       'travel_length': travel_length
+                       }
+        if name in self.phases:
+            for key in ('seconds', 'steps', 'extrusion_length', 'travel_length'):
+                self.phases[name][key] += measurement[key]
+        else:
+            self.phases[name] = dict(measurement)
+        if self.callback is not None:
+            self.callback(measurement)
+
+    @contextmanager
+    def phase(self, name: str, steps: StepBuffer|None = None) -> Iterator[None]:
+        '''time the code in the with-block as phase name, counting the steps in the given buffer
+        '''
+        start = perf_counter()
+        yield
+        self._add(name, perf_counter() - start, len(steps) if steps is not None else 0)
+
+    def timed(self, sections: Iterable[StepBuffer]) -> Iterator[StepBuffer]:
+        '''pass sections through while recording the time taken to generate each one, named by its label
+        '''
+        sections = iter(sections)
+        while True:
+            start = perf_counter()
+            try:
+                section = next(sections)
+            except StopIteration:
+                return
+            seconds = perf_counter() - start
+            extrusion_length, travel_length = self._lengths(section)
+            self._sections.add(section.label or 'section')
+            self._add(section.label or 'section', seconds, len(section), extrusion_length, travel_length)
+            yield section
+
+    def _lengths(self, section: StepBuffer) -> tuple:
+        '''extrusion and travel length of the moves in a section, including the travel from the end of the previous section
+        '''
+        moves = section.rows[section.rows['kind'] == MOVE]
+        if len(moves) == 0:
+            return 0.0, 0.0
+        coordinates = np.stack((moves['x'], moves['y'], moves['z']), axis=1)
+        extrude = moves['extrude']
+        if self._position is not None:
+            coordinates = np.concatenate(([self._position], coordinates))
+        else:
+            extrude = extrude[1:]
+        self._position = coordinates[-1]
+        lengths = np.linalg.norm(np.diff(coordinates, axis=0), axis=1)
+        return float(lengths[extrude].sum()), float(lengths[~extrude].sum())
+
+    @property
+    def total(self) -> dict:
+        '''total time of all phases, steps and lengths of the generated sections
+        '''
+        sections = [phase for name, phase in self.phases.items() if name in self._sections]
+        return {'seconds': sum(phase['seconds'] for phase in self.phases.values()),
+                **{key: sum(phase[key] for phase in sections) for key in ('steps', 'extrusion_length', 'travel_length')}
+                }
+
+    def summary(self) -> str:
+        '''table with a line per phase and the total
+        '''
+        lines = [f"{'phase':<24}{'time (ms)':>12}{'steps':>10}{'extrusion (mm)':>16}{'travel (mm)':>14}"]
+        for phase in list(self.phases.values()) + [{'phase': 'total', **self.total}]:
+            lines.append(f"{phase['phase']:<24}{phase['seconds']*1000:>12.2f}{phase['steps']:>10}{phase['extrusion_length']:>16.1f}{phase['travel_length']:>14.1f}")
+        return '\n'.join(lines)
+
+    def __str__(self) -> str:
+        return self.summary()
@@ -0,0 +1,156 @@
+import numpy as np
+from typing import Iterable
+from stepbuffer import StepBuffer, MOVE
+
+def _coordinates(rows: np.ndarray) -> np.ndarray:
+    return np.stack((rows['x'], rows['y'], rows['z']), axis=1)
+
+def _first_position(buffer: StepBuffer) -> np.ndarray:
+    moves = buffer.rows[buffer.rows['kind'] == MOVE]
+    return _coordinates(moves[:1])[0]
+
+def travel_distance(sections: Iterable[StepBuffer]) -> float:
+    '''total length of all non-extruding moves in a sequence of StepBuffers, including travels between them
+    '''
+    moves = [section.rows[section.rows['kind'] == MOVE] for section in sections]
+    moves = np.concatenate(moves) if moves else np.zeros(0)
+    if len(moves) < 2:
+        return 0.0
+    lengths = np.linalg.norm(np.diff(_coordinates(moves), axis=0), axis=1)
+    return float(lengths[~moves['extrude'][1:]].sum())
+
+def _barb_run(rows: np.ndarray) -> tuple:
+    '''first and last index of the run of independent single-line extrusions (alternating travel and extrude moves)
+    that follows any leading commands in the rows
+    '''
+    is_move = rows['kind'] == MOVE
+    first = int(np.argmax(is_move)) if np.any(is_move) else len(rows)
+    pair_count = (len(rows)-first)//2
+    travels = rows[first:first+2*pair_count:2]
+    extrusions = rows[first+1:first+2*pair_count:2]
+    is_barb = (travels['kind'] == MOVE) & ~travels['extrude'] & (extrusions['kind'] == MOVE) & extrusions['extrude']
+    barb_count = int(np.argmin(is_barb)) if not np.all(is_barb) else pair_count
+    return first, first+2*barb_count
+
+def order_barbs(buffer: StepBuffer, start: np.ndarray|None = None) -> StepBuffer:
+    '''reorder the independent barbs in a buffer with a nearest neighbour search, printing barbs in either direction.
+    Starting from the first barb of the buffer, this alternates the direction of neighbouring barbs.
+    Commands before the barbs stay in place and travels following them (like a z_lift) are moved along with the last barb
+    '''
+    ordered = buffer.copy()
+    first, last = _barb_run(buffer.rows)
+    if last - first < 4:
+        return ordered
+
+    travels = buffer.rows[first:last:2]
+    extrusions = buffer.rows[first+1:last:2]
+    barb_starts = _coordinates(travels)
+    barb_ends = _coordinates(extrusions)
+    barb_count = len(travels)
+
+    position = barb_starts[0] if start is None else np.asarray(start, dtype=float)
+    remaining = np.ones(barb_count, dtype=bool)
+    order = np.empty(barb_count, dtype=int)
+    reverse = np.empty(barb_count, dtype=bool)
+    for index in range(barb_count):
+        start_distance = np.where(remaining, np.linalg.norm(barb_starts - position, axis=1), np.inf)
+        end_distance = np.where(remaining, np.linalg.norm(barb_ends - position, axis=1), np.inf)
+        nearest_start = np.argmin(start_distance)
+        nearest_end = np.argmin(end_distance)
+        if end_distance[nearest_end] < start_distance[nearest_start]:
+            order[index], reverse[index] = nearest_end, True
+            position = barb_starts[nearest_end]
+        else:
+            order[index], reverse[index] = nearest_start, False
+            position = barb_ends[nearest_start]
+        remaining[order[index]] = False
+
+    rows = ordered.rows
+    old_end = rows[last-1][['x', 'y']].tolist()
+    rows[first:last:2] = travels[order]
+    rows[first+1:last:2] = extrusions[order]
+    for axis in ('x', 'y', 'z'):
+        rows[axis][first:last:2][reverse] = extrusions[axis][order][reverse]
+        rows[axis][first+1:last:2][reverse] = travels[axis][order][reverse]
+
+    # travels after the barbs that start from the old last barb, like a z_lift, now start from the new last barb
+    for row in rows[last:]:
+        if row['kind'] != MOVE:
+            continue
+        if row['extrude'] or [row['x'], row['y']] != list(old_end):
+            break
+        row['x'], row['y'] = rows[last-1]['x'], rows[last-1]['y']
+    return ordered
+
+def _feather_order(entries: np.ndarray, exits: np.ndarray, start: np.ndarray) -> list:
+    '''order feathers to minimize travel from each exit to the next entry: nearest neighbour followed by 2-opt
+    '''
+    feather_count = len(entries)
+    costs = np.linalg.norm(exits[:, None, :] - entries[None, :, :], axis=2)
+    start_costs = np.linalg.norm(entries - start, axis=1)
+
+    def tour_cost(order: list) -> float:
+        return start_costs[order[0]] + costs[order[:-1], order[1:]].sum()
+
+    order = [int(np.argmin(start_costs))]
+    remaining = set(range(feather_count)) - set(order)
+    while remaining:
+        candidates = sorted(remaining)
+        order.append(candidates[int(np.argmin(costs[order[-1], candidates]))])
+        remaining.remove(order[-1])
+
+    improved = True
+    while improved:
+        improved = False
+        best_cost = tour_cost(order)
+        for first in range(feather_count-1):
+            for last in range(first+1, feather_count):
+                candidate = order[:first] + order[first:last+1][::-1] + order[last+1:]
+                candidate_cost = tour_cost(candidate)
+                if candidate_cost < best_cost - 1e-9:
+                    order, best_cost, improved = candidate, candidate_cost, True
+    return order
+
+def optimize_feathers(feathers: list, start: tuple = (0, 0, 0), alternate_barbs: bool = True, order_feathers: bool = True, interleave_rachis: bool = True) -> tuple:
+    '''reorder the sections of one or more feathers (a list with a list of StepBuffers per feather, see FeatherPlate.iter_feathers())
+    to reduce non-extruding travel.
+    alternate_barbs: print neighbouring barbs in opposite directions
+    order_feathers: print feathers in nearest neighbour/2-opt order instead of plate order
+    interleave_rachis: print all vanes first, then the rachis layer by layer across all feathers so each layer cools while the others print
+    Returns the reordered sections and a report with the travel distance in mm before and after
+    '''
+    start = np.asarray(start, dtype=float)
+    travel_before = travel_distance(section for sections in feathers for section in sections)
+
+    if alternate_barbs:
+        feathers = [[order_barbs(section) for section in sections] for sections in feathers]
+
+    order = list(range(len(feathers)))
+    if order_feathers and len(feathers) > 1:
+        entries = np.array([_first_position(sections[0]) for sections in feathers])
+        exits = np.array([(_vane_sections(sections) if interleave_rachis else sections)[-1].position for sections in feathers])
+        order = _feather_order(entries, exits, start)
+
+    if interleave_rachis:
+        ordered_sections = [section for index in order for section in _vane_sections(feathers[index])]
+        layer_count = max(len(_rachis_sections(sections)) for sections in feathers)
+        for layer in range(layer_count):
+            for index in order:
+                rachis_sections = _rachis_sections(feathers[index])
+                if layer < len(rachis_sections):
+                    ordered_sections.append(rachis_sections[layer])
+    else:
+        ordered_sections = [section for index in order for section in feathers[index]]
+
+    travel_after = travel_distance(ordered_sections)
+    report = {'travel_before': travel_before,
+              'travel_after': travel_after,
+              'feather_order': order
+              }
+    return ordered_sections, report
+
+def _rachis_sections(sections: list) -> list:
+    return [section for section in sections if (section.label or '').startswith('rachis_layer')]
+
+def _vane_sections(sections: list) -> list:
+    return [section for section in sections if not (section.label or '').startswith('rachis_layer')]
@@ -0,0 +1,233 @@
+'''check a feather or plate for problems before printing: extrusions of different feathers that overlap, moves outside the
+bed and travels that pass low over material printed before them
+
+Segments are put in a uniform grid of square cells, every check only compares segments that share a cell, so the run time
+grows about linearly with the number of segments.
+'''
+import numpy as np
+from fabulousfeathers import FabulousFeather
+from featherplate import FeatherPlate
+from stepbuffer import StepBuffer, MOVE
+
+CELL_SIZE = 2.0 # mm
+
+def _moves(design: FabulousFeather|FeatherPlate|StepBuffer) -> tuple:
+    '''move rows of the design in print order, with the index of the feather each move belongs to
+    '''
+    if isinstance(design, StepBuffer):
+        sections = [[design]]
+    elif isinstance(design, FeatherPlate):
+        sections = design.iter_feathers()
+    else:
+        sections = [list(design.iter_sections())]
+
+    rows, feathers = [], []
+    for feather, feather_sections in enumerate(sections):
+        for section in feather_sections:
+            section_rows = section.rows[section.rows['kind'] == MOVE]
+            rows.append(section_rows)
+            feathers.append(np.full(len(section_rows), feather))
+    moves = np.concatenate(rows) if rows else np.empty(0)
+    if len(moves) < 2:
+        raise Exception("design must contain at least two moves to validate")
+    return moves, np.concatenate(feathers)
+
+def _run_starts(*columns: np.ndarray) -> np.ndarray:
+    '''mask of the elements that differ from the one before in any of the columns, the first element always does
+    '''
+    starts = np.zeros(len(columns[0]), dtype=bool)
+    starts[:1] = True
+    for column in columns:
+        starts[1:] |= column[1:] != column[:-1]
+    return starts
+
+def _cells(starts: np.ndarray, ends: np.ndarray, radii: np.ndarray, grid: tuple) -> tuple:
+    '''(cell keys, segment indices) of every grid cell within radius of each segment, sorted by cell. Segments are sampled
+    every half cell, each sample covers the cells of a square around it that reaches the radius and halfway to the next sample
+    '''
+    origin, cell_size, rows = grid
+    counts = np.ceil(np.hypot(*(ends-starts).T)/(cell_size/2)).astype(np.int64) + 1
+    segments = np.repeat(np.arange(len(starts)), counts)
+    first_sample = np.cumsum(counts) - counts
+    fractions = (np.arange(len(segments)) - first_sample[segments])/np.maximum(counts[segments] - 1, 1)
+    samples = starts[segments] + (ends - starts)[segments]*fractions[:, None] - origin
+    reach = (radii[segments] + cell_size/4)[:, None]
+    lowest = np.floor((samples - reach)/cell_size).astype(np.int64)
+    sizes = np.floor((samples + reach)/cell_size).astype(np.int64) - lowest + 1
+
+    # every cell of the square around each sample
+    cell_counts = sizes[:, 0]*sizes[:, 1]
+    sample_index = np.repeat(np.arange(len(samples)), cell_counts)
+    offsets = np.arange(len(sample_index)) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+    columns = lowest[sample_index, 0] + offsets//sizes[sample_index, 1]
+    cell_rows = lowest[sample_index, 1] + offsets%sizes[sample_index, 1]
+
+    combined = np.sort((columns*rows + cell_rows)*len(starts) + segments[sample_index])
+    combined = combined[_run_starts(combined)]
+    return combined//len(starts), combined%len(starts)
+
+def _candidate_pairs(keys_a: np.ndarray, segments_a: np.ndarray, keys_b: np.ndarray, segments_b: np.ndarray) -> tuple:
+    '''every pair of a segment from a and a segment from b that share a cell, keys_b must be sorted
+    '''
+    left = np.searchsorted(keys_b, keys_a, 'left')
+    counts = np.searchsorted(keys_b, keys_a, 'right') - left
+    a = np.repeat(segments_a, counts)
+    b = segments_b[np.repeat(left - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())]
+    return a, b
+
+def _unique_pairs(a: np.ndarray, b: np.ndarray, count: int) -> tuple:
+    '''sorted distinct pairs of segment indices below count
+    '''
+    combined = np.sort(a*count + b)
+    combined = combined[_run_starts(combined)]
+    return combined//count, combined%count
+
+def _closest_points(p1: np.ndarray, p2: np.ndarray, q1: np.ndarray, q2: np.ndarray) -> tuple:
+    '''distance between 2D segments p and q and the point on p closest to q, for arrays of segments
+    '''
+    def project(points, starts, ends):
+        directions = ends - starts
+        fractions = np.clip(np.sum((points - starts)*directions, axis=1)/np.maximum(np.sum(directions**2, axis=1), 1e-18), 0, 1)
+        return starts + directions*fractions[:, None]
+
+    # closest points are at an end of one of the segments, unless they cross
+    candidates = [(p1, project(p1, q1, q2)), (p2, project(p2, q1, q2)), (project(q1, p1, p2), q1), (project(q2, p1, p2), q2)]
+    distances = np.stack([np.hypot(*(on_p - on_q).T) for on_p, on_q in candidates])
+    nearest = np.argmin(distances, axis=0)
+    rows = np.arange(len(p1))
+    distances = distances[nearest, rows]
+    locations = np.stack([on_p for on_p, _ in candidates])[nearest, rows]
+
+    def cross(u, v):
+        return u[:, 0]*v[:, 1] - u[:, 1]*v[:, 0]
+    p_direction, q_direction = p2 - p1, q2 - q1
+    denominator = cross(p_direction, q_direction)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = cross(q1 - p1, q_direction)/denominator
+        u = cross(q1 - p1, p_direction)/denominator
+    crossing = (denominator != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    distances[crossing] = 0
+    locations[crossing] = p1[crossing] + p_direction[crossing]*t[crossing, None]
+    return distances, locations
+
+def _issues(count: int, entries: list, max_issues: int) -> dict:
+    return {'count': count, 'issues': entries[:max_issues]}
+
+def validate_plate(design: FabulousFeather|FeatherPlate|StepBuffer,
+                   bed: tuple|None = None,
+                   clearance: float = 0.2,
+                   travel_margin: float|None = None,
+                   cell_size: float|None = None,
+                   max_issues: int = 100
+                   ) -> dict:
+    '''check the generated moves of a feather or plate and report where problems are:
+
+    overlaps: extrusions of different feathers closer than their widths, at overlapping heights
+    out_of_bed: moves outside bed, given as (x_min, y_min, x_max, y_max), skipped without a bed
+    low_travels: travels less than clearance above material printed before them, or below it. Travels over their own
+        feather at the height it is printing (like the unlifted travels between barbs) and the first and last travel_margin
+        (defaults to the largest extrusion width) of every travel, where it leaves and joins a line, are not checked
+
+    Each check reports the total count and at most max_issues issues with their location and the feathers involved.
+    cell_size (mm) of the grid defaults to CELL_SIZE
+    '''
+    moves, move_feathers = _moves(design)
+    report = {'segments': len(moves) - 1}
+
+    if bed is None:
+        report['out_of_bed'] = None
+    else:
+        x_min, y_min, x_max, y_max = bed
+        outside = np.flatnonzero((moves['x'] < x_min) | (moves['x'] > x_max) | (moves['y'] < y_min) | (moves['y'] > y_max))
+        report['out_of_bed'] = _issues(len(outside),
+                                       [{'location': (float(moves['x'][index]), float(moves['y'][index]), float(moves['z'][index])),
+                                         'feather': int(move_feathers[index]),
+                                         'extrude': bool(moves['extrude'][index])
+                                         } for index in outside[:max_issues]],
+                                       max_issues)
+
+    # segment i runs from move i to move i+1, and belongs to the feather of its end
+    starts = np.stack((moves['x'][:-1], moves['y'][:-1]), axis=1)
+    ends = np.stack((moves['x'][1:], moves['y'][1:]), axis=1)
+    z_starts, z_ends = moves['z'][:-1], moves['z'][1:]
+    widths, heights = moves['width'][1:], moves['height'][1:]
+    feathers = move_feathers[1:]
+    extrusions = np.flatnonzero(moves['extrude'][1:] & (np.hypot(*(ends-starts).T) > 0))
+
+    max_width = float(widths[extrusions].max()) if len(extrusions) else 0.0
+    travel_margin = max_width if travel_margin is None else travel_margin
+    # the grid covers all moves with a border of a cell and the widest line
+    cell_size = cell_size or CELL_SIZE
+    origin = np.min(np.concatenate((starts, ends)), axis=0) - cell_size - max_width
+    rows = int(np.ptp(np.concatenate((starts, ends))[:, 1])//cell_size) + int(2*(cell_size + max_width)//cell_size) + 3
+    grid = (origin, cell_size, rows)
+    extrusion_keys, extrusion_segments = _cells(starts[extrusions], ends[extrusions], widths[extrusions]/2, grid)
+    extrusion_segments = extrusions[extrusion_segments]
+
+    # feathers and heights of the extrusions in every cell
+    group_starts = np.flatnonzero(_run_starts(extrusion_keys))
+    cell_keys = extrusion_keys[group_starts]
+    cell_feathers, cell_z = feathers[extrusion_segments], z_ends[extrusion_segments]
+    lowest_feather = highest_feather = lowest_z = highest_z = np.zeros(0)
+    if len(group_starts):
+        lowest_feather, highest_feather = np.minimum.reduceat(cell_feathers, group_starts), np.maximum.reduceat(cell_feathers, group_starts)
+        lowest_z, highest_z = np.minimum.reduceat(cell_z, group_starts), np.maximum.reduceat(cell_z, group_starts)
+
+    # overlaps: only cells with extrusions of more than one feather
+    in_shared = np.repeat(lowest_feather != highest_feather, np.diff(np.append(group_starts, len(extrusion_keys))))
+    a, b = _candidate_pairs(extrusion_keys[in_shared], extrusion_segments[in_shared], extrusion_keys[in_shared], extrusion_segments[in_shared])
+    different = feathers[a] < feathers[b]
+    a, b = _unique_pairs(a[different], b[different], len(starts))
+    stacked = (z_ends[a] - heights[a] < z_ends[b]) & (z_ends[b] - heights[b] < z_ends[a])
+    a, b = a[stacked], b[stacked]
+    distances, locations = _closest_points(starts[a], ends[a], starts[b], ends[b])
+    overlapping = np.flatnonzero(distances < (widths[a] + widths[b])/2)
+    report['overlaps'] = _issues(len(overlapping),
+                                 [{'location': (float(locations[index, 0]), float(locations[index, 1]), float(z_ends[a[index]])),
+                                   'feathers': (int(feathers[a[index]]), int(feathers[b[index]])),
+                                   'distance': float(distances[index])
+                                   } for index in overlapping[:max_issues]],
+                                 max_issues)
+
+    # low travels: the middle part of every travel against the extrusions printed before it
+    travels = np.flatnonzero(~moves['extrude'][1:])
+    lengths = np.hypot(*(ends[travels]-starts[travels]).T)
+    travels, lengths = travels[lengths > 2*travel_margin], lengths[lengths > 2*travel_margin]
+    directions = (ends[travels] - starts[travels])/lengths[:, None]
+    travel_starts = starts[travels] + directions*travel_margin
+    travel_ends = ends[travels] - directions*travel_margin
+    travel_keys, travel_segments = _cells(travel_starts, travel_ends, np.zeros(len(travels)), grid)
+    travel_segments = travels[travel_segments]
+    travel_z = np.minimum(z_starts, z_ends)
+    # skip cells with only extrusions of the travel's own feather at its own height
+    cells = np.minimum(np.searchsorted(cell_keys, travel_keys), max(len(cell_keys) - 1, 0))
+    if len(cell_keys):
+        own_cell = ((lowest_feather[cells] == feathers[travel_segments]) & (highest_feather[cells] == feathers[travel_segments])
+                    & (np.abs(lowest_z[cells] - travel_z[travel_segments]) < 1e-9) & (np.abs(highest_z[cells] - travel_z[travel_segments]) < 1e-9))
+        travel_keys, travel_segments = travel_keys[~own_cell], travel_segments[~own_cell]
+    t, e = _candidate_pairs(travel_keys, travel_segments, extrusion_keys, extrusion_segments)
+    # positions of travel segments in the shortened arrays
+    shortened = np.full(len(starts), -1)
+    shortened[travels] = np.arange(len(travels))
+    own_layer = (feathers[t] == feathers[e]) & (np.abs(travel_z[t] - z_ends[e]) < 1e-9)
+    low = (e < t) & (travel_z[t] - z_ends[e] < clearance) & ~own_layer
+    t, e = _unique_pairs(t[low], e[low], len(starts))
+    distances, locations = _closest_points(travel_starts[shortened[t]], travel_ends[shortened[t]], starts[e], ends[e])
+    # sloped travels, like those from a lifted nozzle to the next feather, are only as low as they are where they cross
+    fractions = np.hypot(*(locations - starts[t]).T)/np.maximum(np.hypot(*(ends[t] - starts[t]).T), 1e-18)
+    crossing_z = z_starts[t] + (z_ends[t] - z_starts[t])*fractions
+    over = (distances < widths[e]/2) & (crossing_z - z_ends[e] < clearance)
+    t, e, locations, crossing_z = t[over], e[over], locations[over], crossing_z[over]
+    # report every travel once, with the first line it passes over
+    first = _run_starts(t)
+    t, e, locations, crossing_z = t[first], e[first], locations[first], crossing_z[first]
+    report['low_travels'] = _issues(len(t),
+                                    [{'location': (float(locations[index, 0]), float(locations[index, 1]), float(crossing_z[index])),
+                                      'feather': int(feathers[t[index]]),
+                                      'over_feather': int(feathers[e[index]]),
+                                      'clearance': float(crossing_z[index] - z_ends[e[index]])
+                                      } for index in range(min(len(t), max_issues))],
+                                    max_issues)
+
+    report['valid'] = all(report[check] is None or report[check]['count'] == 0 for check in ('out_of_bed', 'overlaps', 'low_travels'))
+    return report
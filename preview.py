@@ -0,0 +1,130 @@
+'''fast top-down previews of feathers and plates, as SVG, PNG or a binary vertex buffer
+
+fc.transform(steps, 'plot') builds a plotly figure with every segment, which is slow and large for full plates. These
+previews decimate the moves to the level of detail of the output image: points are snapped to the pixel grid, points in
+the same pixel as the previous one are dropped and duplicate segments are drawn once. Extrusions and travels are drawn in
+different colours. In a notebook, show a preview with IPython.display.SVG(render_svg(design)) or
+IPython.display.Image(render_png(design)).
+'''
+import struct
+import zlib
+import numpy as np
+from fabulousfeathers import FabulousFeather
+from featherplate import FeatherPlate
+from stepbuffer import StepBuffer, MOVE
+
+EXTRUSION_COLOUR = (217, 95, 2)
+TRAVEL_COLOUR = (190, 190, 225)
+BACKGROUND_COLOUR = (255, 255, 255)
+
+VERTEX_DTYPE = np.dtype([('start', '<f4', 3), ('end', '<f4', 3), ('extrude', 'u1')])
+
+def _moves(design: FabulousFeather|FeatherPlate|StepBuffer) -> np.ndarray:
+    buffer = design if isinstance(design, StepBuffer) else design.step_buffer()
+    return buffer.rows[buffer.rows['kind'] == MOVE]
+
+def _segments(moves: np.ndarray, resolution: int, travels: bool, margin: int = 2) -> tuple:
+    '''decimated segments in pixel coordinates: (starts, ends, extrude, (width, height)), with y pointing down
+    '''
+    if len(moves) < 2:
+        raise Exception("design must contain at least two moves to preview")
+    coordinates = np.stack((moves['x'], moves['y']), axis=1)
+    minimum = coordinates.min(axis=0)
+    extent = max(float(np.max(coordinates.max(axis=0) - minimum)), 1e-9)
+    scale = (resolution - 1 - 2*margin)/extent
+    pixels = np.rint((coordinates - minimum)*scale).astype(np.int32) + margin
+    size = tuple(int(value) for value in pixels.max(axis=0) + margin + 1)
+    pixels[:, 1] = size[1] - 1 - pixels[:, 1]
+
+    # drop points in the same pixel as the point before, a line through them looks the same
+    extrude = moves['extrude']
+    keep = np.concatenate(([True], np.any(pixels[1:] != pixels[:-1], axis=1)))
+    pixels, extrude = pixels[keep], extrude[keep]
+
+    starts, ends, extrude = pixels[:-1], pixels[1:], extrude[1:]
+    if not travels:
+        starts, ends, extrude = starts[extrude], ends[extrude], extrude[extrude]
+
+    # draw every segment once, whichever direction it was printed in
+    swap = (starts[:, 0] > ends[:, 0]) | ((starts[:, 0] == ends[:, 0]) & (starts[:, 1] > ends[:, 1]))
+    ordered = np.concatenate((np.where(swap[:, None], ends, starts), np.where(swap[:, None], starts, ends), extrude[:, None]), axis=1)
+    ordered = np.unique(ordered, axis=0)
+    # extrusions after travels, so they are drawn on top
+    ordered = ordered[np.argsort(ordered[:, 4], kind='stable')]
+    return ordered[:, 0:2], ordered[:, 2:4], ordered[:, 4].astype(bool), size
+
+def render_svg(design: FabulousFeather|FeatherPlate|StepBuffer, resolution: int = 1000, travels: bool = True) -> str:
+    '''top-down SVG preview with one path for travels and one for extrusions, resolution is the size of the longest side in pixels
+    '''
+    starts, ends, extrude, (width, height) = _segments(_moves(design), resolution, travels)
+    paths = []
+    for is_extrusion, colour, stroke_width in ((False, TRAVEL_COLOUR, 0.5), (True, EXTRUSION_COLOUR, 1)):
+        selected = extrude == is_extrusion
+        if not np.any(selected):
+            continue
+        commands = np.concatenate((starts[selected], ends[selected]), axis=1).tolist()
+        data = ''.join(f'M{x0} {y0}L{x1} {y1}' for x0, y0, x1, y1 in commands)
+        paths.append(f'<path d="{data}" stroke="rgb{colour}" stroke-width="{stroke_width}" fill="none" stroke-linecap="round"/>')
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            f'<rect width="100%" height="100%" fill="rgb{BACKGROUND_COLOUR}"/>' + ''.join(paths) + '</svg>')
+
+def render_image(design: FabulousFeather|FeatherPlate|StepBuffer, resolution: int = 1000, travels: bool = True) -> np.ndarray:
+    '''top-down preview as an (height, width, 3) array of RGB pixels, resolution is the size of the longest side
+    '''
+    starts, ends, extrude, (width, height) = _segments(_moves(design), resolution, travels)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = BACKGROUND_COLOUR
+
+    # sample every segment once per pixel along its longest axis
+    sample_counts = np.max(np.abs(ends - starts), axis=1) + 1
+    segment_index = np.repeat(np.arange(len(starts)), sample_counts)
+    first_sample = np.cumsum(sample_counts) - sample_counts
+    fractions = (np.arange(len(segment_index)) - first_sample[segment_index])/np.maximum(sample_counts[segment_index] - 1, 1)
+    samples = np.rint(starts[segment_index] + (ends - starts)[segment_index]*fractions[:, None]).astype(np.int32)
+    # extrusions are sorted last, so they overwrite travels
+    image[samples[:, 1], samples[:, 0]] = np.where(extrude[segment_index, None], EXTRUSION_COLOUR, TRAVEL_COLOUR)
+    return image
+
+def render_png(design: FabulousFeather|FeatherPlate|StepBuffer, resolution: int = 1000, travels: bool = True) -> bytes:
+    '''top-down preview as PNG file contents
+    '''
+    image = render_image(design, resolution, travels)
+    height, width, _ = image.shape
+    raw = np.concatenate((np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)), axis=1).tobytes()
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+def vertex_buffer(design: FabulousFeather|FeatherPlate|StepBuffer, tolerance: float = 0.0, travels: bool = True) -> np.ndarray:
+    '''segments as a compact structured array of float32 start and end XYZ and an extrude flag (25 bytes per segment),
+    ready for a 3D viewer with .tobytes(). Points closer than tolerance (mm) to the previous point are dropped
+    '''
+    moves = _moves(design)
+    coordinates = np.stack((moves['x'], moves['y'], moves['z']), axis=1)
+    extrude = moves['extrude']
+    if tolerance > 0:
+        keep = np.concatenate(([True], np.any(np.abs(np.diff(np.rint(coordinates/tolerance), axis=0)) > 0, axis=1)))
+        coordinates, extrude = coordinates[keep], extrude[keep]
+
+    vertices = np.empty(len(coordinates) - 1, dtype=VERTEX_DTYPE)
+    vertices['start'] = coordinates[:-1]
+    vertices['end'] = coordinates[1:]
+    vertices['extrude'] = extrude[1:]
+    return vertices if travels else vertices[vertices['extrude'] == 1]
+
+def save_preview(design: FabulousFeather|FeatherPlate|StepBuffer, path: str, resolution: int = 1000, travels: bool = True) -> None:
+    '''write a preview to a .svg, .png or .npy (vertex buffer) file
+    '''
+    if path.endswith('.svg'):
+        with open(path, 'w') as file:
+            file.write(render_svg(design, resolution, travels))
+    elif path.endswith('.png'):
+        with open(path, 'wb') as file:
+            file.write(render_png(design, resolution, travels))
+    elif path.endswith('.npy'):
+        np.save(path, vertex_buffer(design, travels=travels))
+    else:
+        raise Exception("preview path must end with .svg, .png or .npy")
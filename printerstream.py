@@ -0,0 +1,466 @@
+'''stream gcode to a printer while it is being generated
+
+usage: python printerstream.py source (--moonraker HOST[:PORT] | --tcp HOST:PORT | --serial DEVICE | --fake serial|moonraker) [--start-line N]
+
+The source is a .gcode file or a parameter file for cli.py. Gcode is generated in a background thread and handed to the
+sender through a bounded queue, so printing starts straight away, generation pauses when the printer falls behind and
+memory stays flat however large the plate. Two transports are available: MoonrakerTransport sends batches of lines to
+Klipper through Moonraker's HTTP API, SerialTransport talks the line protocol of Marlin or Klipper's virtual serial port
+over a serial device or a TCP socket. Lines are numbered like the lines of the gcode file (from 1): when a stream fails,
+the error names the last line the printer acknowledged, and start_line resumes from the line after it. The printer must
+still be homed and at temperature to resume. FakePrinter is a local stand-in printer server for testing and for
+measuring throughput without hardware, --fake streams to one.
+'''
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+import sys
+import threading
+import time
+from collections import deque
+from itertools import chain
+from typing import Callable, Iterable, Iterator
+from fullcontrol import GcodeControls
+from gcodestream import iter_gcode
+from fabulousfeathers import FabulousFeather
+from featherplate import FeatherPlate
+
+def iter_lines(source: FabulousFeather|FeatherPlate|Iterable, gcode_controls: GcodeControls|None = None, arc_tolerance: float|None = None) -> Iterator[str]:
+    '''single lines of gcode from a FabulousFeather or FeatherPlate, an iterable of fullcontrol steps or an iterable of gcode lines (like an open file)
+    '''
+    if isinstance(source, (FabulousFeather, FeatherPlate)):
+        source = iter_gcode(source.iter_steps(arc_tolerance=arc_tolerance), gcode_controls)
+    else:
+        source = iter(source)
+        first = next(source, None)
+        if first is None:
+            return
+        source = chain([first], source)
+        if not isinstance(first, str):
+            source = iter_gcode(source, gcode_controls)
+    for text in source:
+        # a single step, like a VariableWidthLine, may produce several lines
+        yield from text.rstrip('\n').split('\n')
+
+def _command(line: str) -> str:
+    '''the line without comment and surrounding whitespace, the printer ignores the rest
+    '''
+    return line.split(';', 1)[0].strip()
+
+def _checksum(text: str) -> int:
+    checksum = 0
+    for byte in text.encode():
+        checksum ^= byte
+    return checksum
+
+async def _read_http(reader: asyncio.StreamReader) -> tuple:
+    '''first line, lower case headers and body of an HTTP request or response with a Content-Length
+    '''
+    first_line = (await reader.readline()).decode().strip()
+    if not first_line:
+        raise EOFError
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        name, value = line.split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return first_line, headers, body
+
+class MoonrakerTransport:
+    '''send gcode to Klipper through the Moonraker HTTP API, one gcode script request per batch of lines. Moonraker answers once
+    Klipper has processed the script, so at most one batch is in flight
+    '''
+    def __init__(self, host: str = 'localhost', port: int = 7125, api_key: str|None = None) -> None:
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.last_line = 0
+        self.bytes_sent = 0
+
+    async def connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def send(self, batch: list) -> None:
+        '''send a batch of (line number, command) pairs and wait until the printer has processed them
+        '''
+        body = json.dumps({'script': '\n'.join(command for _, command in batch)}).encode()
+        request = (f'POST /printer/gcode/script HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+                   f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                   + (f'X-Api-Key: {self.api_key}\r\n' if self.api_key is not None else '') + '\r\n').encode() + body
+        self._writer.write(request)
+        await self._writer.drain()
+        self.bytes_sent += len(request)
+        status_line, _, response = await _read_http(self._reader)
+        if status_line.split()[1] != '200':
+            raise Exception(f"moonraker refused the gcode: {status_line} {response.decode()[:200]}")
+        self.last_line = batch[-1][0]
+
+    async def flush(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+class SerialTransport:
+    '''send gcode line by line to firmware that answers every line with ok, like Marlin or Klipper's virtual serial port. Lines
+    get a line number and checksum, so the firmware can ask for a line to be sent again, and at most window lines are
+    unacknowledged at any time. Connects to a TCP socket (host and port, e.g. ser2net or FakePrinter) or to a serial
+    device, which needs pyserial-asyncio
+    '''
+    def __init__(self, host: str|None = None, port: int|None = None, device: str|None = None, baudrate: int = 250000, window: int = 4, history: int = 1000) -> None:
+        if (device is None) == (host is None):
+            raise Exception("set either host and port, or device")
+        self.host = host
+        self.port = port
+        self.device = device
+        self.baudrate = baudrate
+        self.window = window
+        self.last_line = 0
+        self.bytes_sent = 0
+        self.resends = 0
+        # protocol line number: (gcode line number, text) of recently sent lines, for resends
+        self._history = {}
+        self._history_length = max(history, 2*window)
+        self._number = 0
+        # (resend generation, gcode line number) of every line sent and not acknowledged yet, in order
+        self._in_flight = deque()
+        self._generation = 0
+        self._extra_lines = 0
+        self._rejected = False
+        self._failure = None
+
+    async def connect(self) -> None:
+        if self.device is not None:
+            try:
+                import serial_asyncio
+            except ImportError:
+                raise Exception("streaming to a serial device needs pyserial-asyncio: pip install pyserial-asyncio")
+            self._reader, self._writer = await serial_asyncio.open_serial_connection(url=self.device, baudrate=self.baudrate)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._slots = asyncio.Semaphore(self.window)
+        self._acknowledged = asyncio.Event()
+        self._responses = asyncio.create_task(self._read_responses())
+        # start line numbering from 1
+        await self._slots.acquire()
+        self._write(0, 'M110 N0')
+
+    def _write(self, line_number: int, text: str) -> None:
+        self._in_flight.append((self._generation, line_number))
+        self._writer.write((text + '\n').encode())
+        self.bytes_sent += len(text) + 1
+
+    async def send(self, batch: list) -> None:
+        '''send a batch of (line number, command) pairs, waiting whenever window lines are unacknowledged
+        '''
+        for line_number, command in batch:
+            await self._slots.acquire()
+            if self._failure is not None:
+                raise self._failure
+            self._number += 1
+            text = f'N{self._number} {command}'
+            text += f'*{_checksum(text)}'
+            self._history[self._number] = (line_number, text)
+            self._history.pop(self._number - self._history_length, None)
+            self._write(line_number, text)
+            await self._writer.drain()
+
+    async def flush(self) -> None:
+        '''wait until every line sent is acknowledged
+        '''
+        while self._in_flight and self._failure is None:
+            self._acknowledged.clear()
+            await self._acknowledged.wait()
+        if self._failure is not None:
+            raise self._failure
+
+    async def close(self) -> None:
+        self._responses.cancel()
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def _resend(self, number: int) -> None:
+        '''send the lines from protocol line number again. The firmware also rejects the lines that were already on their way
+        after the bad one, those requests are ignored
+        '''
+        self._rejected = True
+        if self._in_flight[0][0] < self._generation:
+            return
+        if number not in self._history:
+            raise Exception(f"printer asked to resend line N{number}, which is no longer in the history")
+        self._generation += 1
+        self.resends += 1
+        for resent in range(number, self._number + 1):
+            self._extra_lines += 1
+            self._write(*self._history[resent])
+
+    async def _read_responses(self) -> None:
+        try:
+            while True:
+                response = (await self._reader.readline()).decode().strip()
+                if not response:
+                    if self._reader.at_eof():
+                        raise Exception("printer closed the connection")
+                    continue
+                if response.startswith('ok'):
+                    _, line_number = self._in_flight.popleft()
+                    if self._rejected:
+                        self._rejected = False
+                    else:
+                        self.last_line = max(self.last_line, line_number)
+                    if self._extra_lines > 0:
+                        self._extra_lines -= 1
+                    else:
+                        self._slots.release()
+                    self._acknowledged.set()
+                elif response.lower().startswith(('resend:', 'rs ')):
+                    self._resend(int(response.replace(':', ' ').split()[1].lstrip('N')))
+                elif response.startswith('!!') or 'halted' in response.lower() or 'kill' in response.lower():
+                    raise Exception(f"printer stopped: {response}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            self._failure = error
+            # wake up any sender or flush waiting for the printer
+            for _ in range(self.window):
+                self._slots.release()
+            self._acknowledged.set()
+
+def _produce(lines: Iterator[str], start_line: int, batch_lines: int, queue: asyncio.Queue, loop: asyncio.AbstractEventLoop, stop: threading.Event) -> None:
+    '''generate lines in a background thread and put batches of (line number, command) pairs on the queue, waiting while it is full
+    '''
+    def put(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    try:
+        batch = []
+        for line_number, line in enumerate(lines, 1):
+            command = _command(line)
+            if line_number < start_line or not command:
+                continue
+            batch.append((line_number, command))
+            if len(batch) == batch_lines:
+                if not put(batch):
+                    return
+                batch = []
+        if batch:
+            put(batch)
+        put(None)
+    except Exception as error:
+        put(error)
+
+async def stream(source: FabulousFeather|FeatherPlate|Iterable,
+                 transport: MoonrakerTransport|SerialTransport,
+                 gcode_controls: GcodeControls|None = None,
+                 start_line: int = 1,
+                 buffer_lines: int = 2000,
+                 batch_lines: int = 50,
+                 arc_tolerance: float|None = None,
+                 progress: Callable[[dict], None]|None = None
+                 ) -> dict:
+    '''generate gcode for the source (see iter_lines) and stream it to the printer, starting at gcode line start_line.
+    At most buffer_lines lines are generated ahead of the printer. Comments and empty lines are not sent. progress is
+    called with the report after every batch. Returns a report with the lines sent, the last line acknowledged and the throughput
+    '''
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max(1, buffer_lines//batch_lines))
+    stop = threading.Event()
+    lines = iter_lines(source, gcode_controls, arc_tolerance)
+    producer = threading.Thread(target=_produce, args=(lines, start_line, batch_lines, queue, loop, stop), daemon=True)
+    report = {'start_line': start_line, 'last_line': start_line-1, 'lines_sent': 0, 'bytes_sent': 0, 'seconds': 0.0, 'lines_per_second': 0.0}
+    start = time.perf_counter()
+
+    def update() -> None:
+        report['last_line'] = max(report['last_line'], transport.last_line)
+        report['bytes_sent'] = transport.bytes_sent
+        report['seconds'] = time.perf_counter() - start
+        report['lines_per_second'] = report['lines_sent']/max(report['seconds'], 1e-9)
+
+    await transport.connect()
+    producer.start()
+    try:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            await transport.send(batch)
+            report['lines_sent'] += len(batch)
+            update()
+            if progress is not None:
+                progress(report)
+        await transport.flush()
+        update()
+    except Exception as error:
+        update()
+        raise Exception(f"streaming stopped after line {report['last_line']}, resume with start_line={report['last_line']+1}: {error}") from error
+    finally:
+        stop.set()
+        await transport.close()
+        await asyncio.to_thread(producer.join)
+    return report
+
+class FakePrinter:
+    '''local stand-in printer server for testing streams and measuring throughput without hardware. It answers the serial line
+    protocol like Marlin (protocol='serial', use SerialTransport with its host and port) or Moonraker's gcode script
+    endpoint (protocol='moonraker'). Received commands are kept in commands. line_time simulates the time the firmware
+    takes per command, and error_rate corrupts that fraction of received lines to exercise resends
+    '''
+    def __init__(self, protocol: str = 'serial', host: str = '127.0.0.1', port: int = 0, line_time: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+        if protocol not in ('serial', 'moonraker'):
+            raise Exception("protocol must be 'serial' or 'moonraker'")
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self.line_time = line_time
+        self.error_rate = error_rate
+        self.commands = []
+        self._random = random.Random(seed)
+
+    async def __aenter__(self) -> 'FakePrinter':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exception) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        handler = self._serial if self.protocol == 'serial' else self._moonraker
+        self._server = await asyncio.start_server(handler, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    def transport(self, **options) -> MoonrakerTransport|SerialTransport:
+        '''a transport connected to this printer
+        '''
+        if self.protocol == 'serial':
+            return SerialTransport(self.host, self.port, **options)
+        return MoonrakerTransport(self.host, self.port, **options)
+
+    async def _serial(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        expected = 1
+        try:
+            while line := (await reader.readline()).decode().strip():
+                if line.startswith('N'):
+                    text, _, checksum = line.rpartition('*')
+                    number_text, _, command = text.partition(' ')
+                    number = int(number_text[1:])
+                    if not checksum or int(checksum) != _checksum(text) or self._random.random() < self.error_rate:
+                        writer.write(f'Error:checksum mismatch, Last Line: {expected-1}\nResend: {expected}\nok\n'.encode())
+                        continue
+                    if number != expected:
+                        writer.write(f'Error:Line Number is not Last Line Number+1, Last Line: {expected-1}\nResend: {expected}\nok\n'.encode())
+                        continue
+                    expected += 1
+                else:
+                    command = line
+                if command.startswith('M110'):
+                    expected = int(command.split('N')[1]) + 1
+                else:
+                    self.commands.append(command)
+                if self.line_time:
+                    await asyncio.sleep(self.line_time)
+                writer.write(b'ok\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _moonraker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line, _, body = await _read_http(reader)
+                if request_line.split()[:2] == ['POST', '/printer/gcode/script']:
+                    commands = json.loads(body)['script'].split('\n')
+                    self.commands.extend(commands)
+                    if self.line_time:
+                        await asyncio.sleep(self.line_time*len(commands))
+                    status, response = '200 OK', {'result': 'ok'}
+                else:
+                    status, response = '404 Not Found', {'error': {'code': 404, 'message': 'Not Found'}}
+                response = json.dumps(response).encode()
+                writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(response)}\r\n\r\n'.encode() + response)
+                await writer.drain()
+        except (EOFError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+def _address(text: str, default_port: int|None = None) -> tuple:
+    host, _, port = text.rpartition(':') if ':' in text else (text, '', default_port)
+    if port in ('', None):
+        raise Exception(f"{text} needs a port, like host:port")
+    return host, int(port)
+
+async def _main(arguments: argparse.Namespace) -> dict:
+    if arguments.source.endswith('.gcode'):
+        source, gcode_controls = open(arguments.source), None
+    else:
+        from cli import read_parameters, build, design_steps
+        parameters = read_parameters(arguments.source)
+        design, gcode_controls = build(parameters)
+        source = design_steps(design, parameters)
+
+    printer = None
+    if arguments.fake is not None:
+        printer = FakePrinter(arguments.fake)
+        await printer.start()
+        transport = printer.transport()
+    elif arguments.moonraker is not None:
+        transport = MoonrakerTransport(*_address(arguments.moonraker, 7125), api_key=arguments.api_key)
+    elif arguments.tcp is not None:
+        transport = SerialTransport(*_address(arguments.tcp))
+    else:
+        transport = SerialTransport(device=arguments.serial, baudrate=arguments.baudrate)
+
+    def progress(report: dict) -> None:
+        print(f"\rline {report['last_line']}, {report['lines_per_second']:.0f} lines/s", end='', file=sys.stderr)
+
+    try:
+        return await stream(source, transport, gcode_controls, start_line=arguments.start_line, progress=progress)
+    finally:
+        print(file=sys.stderr)
+        if arguments.source.endswith('.gcode'):
+            source.close()
+        if printer is not None:
+            await printer.stop()
+
+def main(arguments: list|None = None) -> None:
+    parser = argparse.ArgumentParser(description='stream gcode to a printer while it is generated')
+    parser.add_argument('source', help='.gcode file, or YAML or JSON parameter file for cli.py')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--moonraker', help='Moonraker address, host or host:port')
+    target.add_argument('--tcp', help='host:port of a serial line protocol socket, like ser2net')
+    target.add_argument('--serial', help='serial device, needs pyserial-asyncio')
+    target.add_argument('--fake', choices=['serial', 'moonraker'], help='stream to a local fake printer and report the throughput')
+    parser.add_argument('--api-key', help='Moonraker API key')
+    parser.add_argument('--baudrate', type=int, default=250000)
+    parser.add_argument('--start-line', type=int, default=1, help='first gcode line to send, to resume a stream')
+    report = asyncio.run(_main(parser.parse_args(arguments)))
+    print(f"{report['lines_sent']} lines sent up to line {report['last_line']} in {report['seconds']:.2f} s ({report['lines_per_second']:.0f} lines/s)", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
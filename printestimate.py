@@ -0,0 +1,102 @@
+from math import pi
+import numpy as np
+from fabulousfeathers import FabulousFeather
+from featherplate import FeatherPlate
+from stepbuffer import StepBuffer, MOVE, PRINTER_COMMAND
+
+def _move_times(lengths: np.ndarray, cruise_speeds: np.ndarray, entry_speeds: np.ndarray, exit_speeds: np.ndarray, accelerations: np.ndarray) -> np.ndarray:
+    '''time of each move with a trapezoidal speed profile: accelerate from the entry speed, cruise, decelerate to the exit speed.
+    Moves too short to reach the cruise speed get a triangular profile
+    '''
+    acceleration_distances = (cruise_speeds**2 - entry_speeds**2)/(2*accelerations)
+    deceleration_distances = (cruise_speeds**2 - exit_speeds**2)/(2*accelerations)
+    cruise_distances = lengths - acceleration_distances - deceleration_distances
+
+    peak_speeds = np.where(cruise_distances >= 0,
+                           cruise_speeds,
+                           np.sqrt(np.maximum((2*accelerations*lengths + entry_speeds**2 + exit_speeds**2)/2, 0))
+                           )
+    return (peak_speeds-entry_speeds)/accelerations + (peak_speeds-exit_speeds)/accelerations + np.maximum(cruise_distances, 0)/cruise_speeds
+
+def estimate_print(design: FabulousFeather|FeatherPlate|StepBuffer,
+                   print_speed: float = 1000,
+                   travel_speed: float = 8000,
+                   acceleration: float = 1000,
+                   travel_acceleration: float|None = None,
+                   junction_deviation: float = 0.013,
+                   max_z_speed: float|None = None,
+                   retraction_length: float = 3.0,
+                   retraction_speed: float = 45,
+                   dia_feed: float = 1.75,
+                   density: float = 1.27
+                   ) -> dict:
+    '''estimate print time and filament use directly from the generated moves, without generating gcode.
+    Speeds are in mm/min like fullcontrol (moves without a speed use print_speed), accelerations in mm/s^2, retraction_speed
+    in mm/s and density in g/cm^3, the retraction defaults are those of Marlin's firmware retraction (G10/G11).
+    Junction speeds follow the junction deviation model and are limited so every move can reach its neighbours' speeds,
+    printer commands like retraction stop the motion. The start and end procedures and the move to the first point are
+    not included.
+    '''
+    buffer = design if isinstance(design, StepBuffer) else design.step_buffer()
+    rows = buffer.rows
+    is_move = rows['kind'] == MOVE
+    moves = rows[is_move]
+    if len(moves) < 2:
+        raise Exception("design must contain at least two moves to estimate a print")
+
+    coordinates = np.stack((moves['x'], moves['y'], moves['z']), axis=1)
+    offsets = np.diff(coordinates, axis=0)
+    lengths = np.linalg.norm(offsets, axis=1)
+    extrude = moves['extrude'][1:]
+
+    # a move that follows a printer command or manual gcode starts from standstill
+    command_counts = np.cumsum(~is_move)[is_move]
+    stops = np.diff(command_counts) > 0
+
+    # drop moves without length, they take no time, but keep their stop for the next move that has length
+    moving = np.flatnonzero(lengths > 0)
+    stops = np.maximum.reduceat(stops, np.concatenate(([0], moving[:-1]+1))) if len(moving) else stops[moving]
+    offsets, lengths, extrude = offsets[moving], lengths[moving], extrude[moving]
+    speeds = np.where(extrude, np.nan_to_num(moves['speed'][1:][moving], nan=print_speed), travel_speed)/60
+    accelerations = np.where(extrude, acceleration, travel_acceleration or acceleration)
+    if max_z_speed is not None:
+        z_fractions = np.abs(offsets[:, 2])/lengths
+        speeds = np.minimum(speeds, np.where(z_fractions > 0, max_z_speed/np.maximum(z_fractions, 1e-12), np.inf))
+
+    # junction deviation: the sharper the corner, the lower the speed through it
+    directions = offsets/lengths[:, None]
+    cosines = np.clip(-np.sum(directions[:-1]*directions[1:], axis=1), -1, 1)
+    half_angle_sines = np.sqrt(0.5*(1-cosines))
+    junction_accelerations = np.minimum(accelerations[:-1], accelerations[1:])
+    with np.errstate(divide='ignore'):
+        junction_speeds = np.sqrt(junction_accelerations*junction_deviation*half_angle_sines/np.maximum(1-half_angle_sines, 0))
+    junction_speeds = np.minimum.reduce([junction_speeds,
+                                         speeds[:-1],
+                                         speeds[1:],
+                                         # low enough to reach from and to standstill halfway along either neighbour
+                                         np.sqrt(accelerations[:-1]*lengths[:-1]),
+                                         np.sqrt(accelerations[1:]*lengths[1:])
+                                         ])
+    junction_speeds[stops[1:]] = 0
+    entry_speeds = np.concatenate(([0.0], junction_speeds))
+    exit_speeds = np.concatenate((junction_speeds, [0.0]))
+
+    times = _move_times(lengths, speeds, entry_speeds, exit_speeds, accelerations)
+
+    commands = rows['text'][rows['kind'] == PRINTER_COMMAND]
+    retraction_count = sum(buffer.texts[text] in ('retract', 'unretract') for text in commands.tolist())
+    retraction_time = retraction_count*retraction_length/retraction_speed
+
+    extrusion_volume = float(np.sum(lengths[extrude]*moves['width'][1:][moving][extrude]*moves['height'][1:][moving][extrude]))
+    filament_length = extrusion_volume/(pi*(dia_feed/2)**2)
+    return {'print_time': float(times[extrude].sum()),
+            'travel_time': float(times[~extrude].sum()),
+            'retraction_time': retraction_time,
+            'total_time': float(times.sum()) + retraction_time,
+            'extrusion_length': float(lengths[extrude].sum()),
+            'travel_length': float(lengths[~extrude].sum()),
+            'retractions': retraction_count,
+            'extrusion_volume': extrusion_volume,
+            'filament_length': filament_length,
+            'filament_mass': extrusion_volume*density/1000
+            }
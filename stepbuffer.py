@@ -0,0 +1,259 @@
+from fullcontrol import Point, Extruder, ExtrusionGeometry, Printer, PrinterCommand, ManualGcode, Vector
+import numpy as np
+from typing import Iterable, Iterator
+from variablewidthline import VariableWidthLine
+
+# kinds of rows in a StepBuffer
+MOVE = 0
+PRINTER_COMMAND = 1
+MANUAL_GCODE = 2
+
+STEP_DTYPE = np.dtype([('x', 'f8'),
+                       ('y', 'f8'),
+                       ('z', 'f8'),
+                       ('width', 'f8'),
+                       ('height', 'f8'),
+                       ('speed', 'f8'),
+                       ('extrude', '?'),
+                       ('kind', 'i1'),
+                       ('text', 'i4')
+                       ])
+
+class StepBuffer:
+    '''compact array-backed list of steps, one record per move holding x/y/z, extruder state, width/height and speed.
+    Printer commands and manual gcode are stored as records referring to a shared list of texts.
+    Use to_steps() to convert to fullcontrol steps. The optional label names the section of a design held in the buffer.
+    '''
+    def __init__(self, capacity: int = 1024, label: str|None = None) -> None:
+        self.label = label
+        self._rows = np.zeros(max(capacity, 1), dtype=STEP_DTYPE)
+        self._length = 0
+        self._last_move = -1
+        self.texts = []
+        self.width = np.nan
+        self.height = np.nan
+        self.speed = np.nan
+
+    def __len__(self) -> int:
+        return self._length
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray, texts: list, label: str|None = None) -> 'StepBuffer':
+        '''create a buffer from an array of STEP_DTYPE records and the texts they refer to, like a stored buffer
+        '''
+        buffer = cls(capacity=len(rows), label=label)
+        buffer._allocate(len(rows))[:] = rows
+        buffer.texts = list(texts)
+        moves = np.flatnonzero(rows['kind'] == MOVE)
+        buffer._last_move = int(moves[-1]) if len(moves) else -1
+        return buffer
+
+    @property
+    def rows(self) -> np.ndarray:
+        '''structured array view of the records in the buffer
+        '''
+        return self._rows[:self._length]
+
+    @property
+    def nbytes(self) -> int:
+        return self.rows.nbytes
+
+    @property
+    def position(self) -> tuple:
+        '''x, y, z of the last move in the buffer
+        '''
+        if self._last_move < 0:
+            raise Exception("StepBuffer does not contain any moves")
+        row = self._rows[self._last_move]
+        return float(row['x']), float(row['y']), float(row['z'])
+
+    def last_point(self) -> Point:
+        x, y, z = self.position
+        return Point(x=x, y=y, z=z)
+
+    def _allocate(self, count: int) -> np.ndarray:
+        '''reserve count records at the end of the buffer and return them as a view
+        '''
+        required = self._length + count
+        if required > len(self._rows):
+            rows = np.zeros(max(required, 2*len(self._rows)), dtype=STEP_DTYPE)
+            rows[:self._length] = self._rows[:self._length]
+            self._rows = rows
+        new_rows = self._rows[self._length:required]
+        self._length = required
+        return new_rows
+
+    def set_geometry(self, width: float|None = None, height: float|None = None) -> None:
+        '''set the rectangular extrusion geometry used for subsequent moves
+        '''
+        if width is not None:
+            self.width = width
+        if height is not None:
+            self.height = height
+
+    def set_speed(self, speed: float) -> None:
+        '''set the print speed used for subsequent moves
+        '''
+        self.speed = speed
+
+    def set_speeds(self, speed: float) -> None:
+        '''set the print speed of all moves in the buffer and of subsequent moves
+        '''
+        self.rows['speed'][self.rows['kind'] == MOVE] = speed
+        self.speed = speed
+
+    def append_points(self, coordinates: np.ndarray, extrude: bool|np.ndarray = True, widths: np.ndarray|None = None) -> None:
+        '''append an (n, 3) array of moves, optionally with a width per move (the width of the line ending at that point)
+        '''
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 3)
+        if len(coordinates) == 0:
+            return
+        new_rows = self._allocate(len(coordinates))
+        new_rows['x'] = coordinates[:, 0]
+        new_rows['y'] = coordinates[:, 1]
+        new_rows['z'] = coordinates[:, 2]
+        new_rows['width'] = self.width if widths is None else widths
+        new_rows['height'] = self.height
+        new_rows['speed'] = self.speed
+        new_rows['extrude'] = extrude
+        new_rows['kind'] = MOVE
+        new_rows['text'] = -1
+        self._last_move = self._length - 1
+        if widths is not None:
+            self.width = float(new_rows['width'][-1])
+
+    def travel_to(self, x: float, y: float, z: float) -> None:
+        self.append_points([(x, y, z)], extrude=False)
+
+    def extrude_to(self, x: float, y: float, z: float) -> None:
+        self.append_points([(x, y, z)], extrude=True)
+
+    def append_barbs(self, barbs: np.ndarray) -> None:
+        '''append an (n, 2, 3) array of barbs, travelling to each start and extruding to each end
+        '''
+        barbs = np.asarray(barbs, dtype=float).reshape(-1, 2, 3)
+        extrude = np.tile([False, True], len(barbs))
+        self.append_points(barbs.reshape(-1, 3), extrude=extrude)
+
+    def _append_text(self, kind: int, text: str) -> None:
+        new_rows = self._allocate(1)
+        new_rows['kind'] = kind
+        new_rows['text'] = len(self.texts)
+        self.texts.append(text)
+
+    def printer_command(self, id: str) -> None:
+        self._append_text(PRINTER_COMMAND, id)
+
+    def manual_gcode(self, text: str) -> None:
+        self._append_text(MANUAL_GCODE, text)
+
+    def extend(self, other: 'StepBuffer') -> None:
+        '''append all records of another StepBuffer, the current geometry and speed are taken over from other
+        '''
+        if len(other) == 0:
+            return
+        start = self._length
+        new_rows = self._allocate(len(other))
+        new_rows[:] = other.rows
+        for attribute in ('width', 'height', 'speed'):
+            # records without geometry or speed inherit the current state of this buffer
+            unset = np.isnan(new_rows[attribute])
+            new_rows[attribute][unset] = getattr(self, attribute)
+        has_text = new_rows['kind'] != MOVE
+        new_rows['text'][has_text] += len(self.texts)
+        self.texts.extend(other.texts)
+        if other._last_move >= 0:
+            self._last_move = start + other._last_move
+        for attribute in ('width', 'height', 'speed'):
+            if not np.isnan(getattr(other, attribute)):
+                setattr(self, attribute, getattr(other, attribute))
+
+    def copy(self) -> 'StepBuffer':
+        buffer = StepBuffer(capacity=len(self), label=self.label)
+        buffer.extend(self)
+        return buffer
+
+    def translate(self, vector: Vector) -> None:
+        '''move all points in the buffer by vector, in place
+        '''
+        is_move = self.rows['kind'] == MOVE
+        for axis in ('x', 'y', 'z'):
+            offset = getattr(vector, axis)
+            if offset:
+                self.rows[axis][is_move] += offset
+
+    def rotate(self, centre: Point, angle: float) -> None:
+        '''rotate all points in the buffer by angle (radians) about centre in the XY plane, in place, like fc.move_polar()
+        '''
+        is_move = self.rows['kind'] == MOVE
+        x = self.rows['x'][is_move] - centre.x
+        y = self.rows['y'][is_move] - centre.y
+        self.rows['x'][is_move] = centre.x + x*np.cos(angle) - y*np.sin(angle)
+        self.rows['y'][is_move] = centre.y + x*np.sin(angle) + y*np.cos(angle)
+
+    def to_steps(self) -> list:
+        '''convert the buffer to a list of fullcontrol steps, only emitting state changes where they occur
+        '''
+        return list(steps_from_buffers([self]))
+
+def _width_runs(rows: np.ndarray) -> np.ndarray:
+    '''for each record, the index after the run of extruding moves with the same height and speed it belongs to
+    '''
+    extruding = (rows['kind'] == MOVE) & rows['extrude']
+    same_height = (rows['height'][:-1] == rows['height'][1:]) | (np.isnan(rows['height'][:-1]) & np.isnan(rows['height'][1:]))
+    same_speed = (rows['speed'][:-1] == rows['speed'][1:]) | (np.isnan(rows['speed'][:-1]) & np.isnan(rows['speed'][1:]))
+    continues = np.append(extruding[:-1] & extruding[1:] & same_height & same_speed, False)
+    run_ends = np.flatnonzero(~continues)
+    return run_ends[np.searchsorted(run_ends, np.arange(len(rows)))] + 1
+
+def steps_from_buffers(buffers: Iterable[StepBuffer], variable_width_lines: bool = False) -> Iterator:
+    '''lazily convert a sequence of StepBuffers to fullcontrol steps, tracking state across buffers so only state changes are emitted.
+    Records without geometry or speed keep the state of the previous buffers.
+    With variable_width_lines, runs of extruding moves with a changing width are emitted as a single VariableWidthLine after
+    their first Point. fullcontrol's move() and move_polar() only move Points, so leave it off for steps that will be moved.
+    '''
+    extruder_on = None
+    width = height = speed = None
+    for buffer in buffers:
+        rows = buffer.rows
+        run_ends = _width_runs(rows) if variable_width_lines else None
+        records = rows.tolist()
+        index = 0
+        while index < len(records):
+            x, y, z, row_width, row_height, row_speed, extrude, kind, text = records[index]
+            index += 1
+            if kind == PRINTER_COMMAND:
+                yield PrinterCommand(id=buffer.texts[text])
+                continue
+            if kind == MANUAL_GCODE:
+                yield ManualGcode(text=buffer.texts[text])
+                continue
+
+            if extrude:
+                row_width = width if row_width != row_width else row_width
+                row_height = height if row_height != row_height else row_height
+                if row_width is None or row_height is None:
+                    raise Exception("extrusion geometry must be set before extruding, use set_geometry()")
+                if width is None or height is None:
+                    yield ExtrusionGeometry(area_model='rectangle', width=row_width, height=row_height)
+                    width, height = row_width, row_height
+                elif row_width != width or row_height != height:
+                    yield ExtrusionGeometry(width=row_width if row_width != width else None,
+                                            height=row_height if row_height != height else None
+                                            )
+                    width, height = row_width, row_height
+                if row_speed == row_speed and row_speed != speed:
+                    yield Printer(print_speed=row_speed)
+                    speed = row_speed
+            if extrude != extruder_on:
+                yield Extruder(on=extrude)
+                extruder_on = extrude
+            yield Point(x=x, y=y, z=z)
+
+            if variable_width_lines and extrude and run_ends[index-1] - index > 1:
+                run = rows[index:run_ends[index-1]]
+                widths = run['width']
+                if not np.any(np.isnan(widths)) and np.any(widths != width):
+                    yield VariableWidthLine(np.stack((run['x'], run['y'], run['z']), axis=1), widths)
+                    width = float(widths[-1])
+                    index = run_ends[index-1]
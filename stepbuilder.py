@@ -0,0 +1,68 @@
+from stepbuffer import StepBuffer, MANUAL_GCODE
+
+class StepBuilder(StepBuffer):
+    '''StepBuffer that tracks the state of the printer while steps are appended: position, extruder, retraction,
+    extrusion geometry and speed. z_lift, wipe and retraction are constant-time operations on the current state,
+    and commands that would not change the state are dropped.
+    '''
+    def __init__(self, capacity: int = 1024, label: str|None = None, retracted: bool = False) -> None:
+        super().__init__(capacity, label)
+        self.retracted = retracted
+
+    @property
+    def extruding(self) -> bool:
+        '''whether the last move in the builder extruded
+        '''
+        return self._last_move >= 0 and bool(self._rows['extrude'][self._last_move])
+
+    def copy(self) -> 'StepBuilder':
+        builder = StepBuilder(capacity=len(self), label=self.label, retracted=self.retracted)
+        builder.extend(self)
+        return builder
+
+    def extend(self, other: StepBuffer) -> None:
+        super().extend(other)
+        if isinstance(other, StepBuilder):
+            self.retracted = other.retracted
+
+    def travel_to(self, x: float, y: float, z: float) -> None:
+        '''travel to x, y, z, unless the nozzle is already there
+        '''
+        if self._last_move >= 0 and self.position == (x, y, z):
+            return
+        super().travel_to(x, y, z)
+
+    def manual_gcode(self, text: str) -> None:
+        '''add a line of gcode, unless it repeats the previous command
+        '''
+        if self._length > 0 and self._rows['kind'][self._length-1] == MANUAL_GCODE and self.texts[self._rows['text'][self._length-1]] == text:
+            return
+        super().manual_gcode(text)
+
+    def retract(self) -> None:
+        if not self.retracted:
+            self.printer_command('retract')
+            self.retracted = True
+
+    def unretract(self) -> None:
+        if self.retracted:
+            self.printer_command('unretract')
+            self.retracted = False
+
+    def z_lift(self, lift_height: float) -> None:
+        '''travel up by lift_height from the current position
+        '''
+        x, y, z = self.position
+        self.travel_to(x, y, z+lift_height)
+
+    def z_unlift(self, lift_height: float) -> None:
+        '''travel down by lift_height from the current position
+        '''
+        x, y, z = self.position
+        self.travel_to(x, y, z-lift_height)
+
+    def wipe(self, distance: float) -> None:
+        '''travel distance along X from the current position
+        '''
+        x, y, z = self.position
+        self.travel_to(x+distance, y, z)
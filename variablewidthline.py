@@ -0,0 +1,86 @@
+from fullcontrol import Point, ExtrusionGeometry
+from math import pi
+import numpy as np
+
+class VariableWidthLine:
+    '''extruded polyline with a width per point (the width of the line ending at that point), for lines like the tapering rachis.
+    Stored as an (n, 3) array of coordinates and an array of widths instead of an ExtrusionGeometry and a Point per point.
+    E values for all lines are calculated in one vectorized pass when gcode is generated, the height comes from the current
+    ExtrusionGeometry. After the line, the ExtrusionGeometry keeps the width of the last point.
+    '''
+    def __init__(self, coordinates: np.ndarray, widths: np.ndarray) -> None:
+        self.coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 3)
+        self.widths = np.asarray(widths, dtype=float).reshape(-1)
+        if len(self.coordinates) != len(self.widths):
+            raise Exception("coordinates and widths don't have the same length")
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def __repr__(self) -> str:
+        return f'VariableWidthLine({len(self)} points, width {self.widths.min()}-{self.widths.max()})'
+
+    def steps(self) -> list:
+        '''expand to an ExtrusionGeometry and a Point per point
+        '''
+        steps = []
+        for (x, y, z), width in zip(self.coordinates.tolist(), self.widths.tolist()):
+            steps.append(ExtrusionGeometry(width=width))
+            steps.append(Point(x=x, y=y, z=z))
+        return steps
+
+    def _areas(self, geometry) -> np.ndarray:
+        if geometry.area_model == 'rectangle':
+            return self.widths*geometry.height
+        elif geometry.area_model == 'stadium':
+            return (self.widths-geometry.height)*geometry.height + pi*(geometry.height/2)**2
+        raise Exception(f"VariableWidthLine does not support area_model '{geometry.area_model}', use 'rectangle' or 'stadium'")
+
+    def gcode(self, state) -> str|None:
+        '''process this line in a list of steps to generate lines of gcode, equivalent to the gcode of steps()
+        '''
+        if len(self) == 0:
+            return None
+        if not state.extruder.on:
+            raise Exception("VariableWidthLine can only be printed with the extruder on")
+        start = state.point
+        if None in (start.x, start.y, start.z):
+            raise Exception("the position before a VariableWidthLine must be known, add a Point before it")
+
+        coordinates = np.concatenate(([(start.x, start.y, start.z)], self.coordinates))
+        offsets = np.diff(coordinates, axis=0)
+        lengths = (offsets[:, 0]**2 + offsets[:, 1]**2 + offsets[:, 2]**2)**0.5
+        moved = np.any(offsets != 0, axis=1)
+
+        # running total volume, added up in the same order as fullcontrol does per Point
+        extruder = state.extruder
+        total_volumes = np.cumsum(np.concatenate(([extruder.total_volume], lengths*self._areas(state.extrusion_geometry))))
+        if extruder.relative_gcode == True:
+            e_values = np.diff(total_volumes)*extruder.volume_to_e
+            extruder.total_volume_ref = float(total_volumes[-1])
+        else:
+            e_values = (total_volumes[1:] - extruder.total_volume_ref)*extruder.volume_to_e
+        extruder.total_volume = float(total_volumes[-1])
+
+        lines = []
+        previous = coordinates[0].tolist()
+        for point, e_value, point_moved in zip(coordinates[1:].tolist(), e_values.tolist(), moved.tolist()):
+            if not point_moved:
+                continue
+            XYZ_str = ''.join(f'{axis}{value:.6f}'.rstrip('0').rstrip('.') + ' ' for axis, value, previous_value in zip('XYZ', point, previous) if value != previous_value)
+            F_str = state.printer.f_gcode(state)
+            state.printer.speed_changed = False
+            lines.append(f'G1 {F_str}{XYZ_str}' + f'E{e_value:.6f}'.rstrip('0').rstrip('.'))
+            previous = point
+
+        x, y, z = self.coordinates[-1].tolist()
+        state.point.update_from(Point(x=x, y=y, z=z))
+        state.extrusion_geometry.width = float(self.widths[-1])
+        state.extrusion_geometry.update_area()
+        return '\n'.join(lines) if lines else None
+
+    def visualize(self, state, plot_data, plot_controls) -> None:
+        '''plot the line point by point, with the width of each line
+        '''
+        for step in self.steps():
+            step.visualize(state, plot_data, plot_controls)
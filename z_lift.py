@@ -1,19 +1,29 @@
 from fullcontrol import Point, travel_to, Union
+from stepbuffer import StepBuffer
 
-def z_lift(geometry: Union[Point, list], lift_height: float) -> list:
-    '''lift z from Point or last position in provided geometry, extend to geometry
+def _lifted(geometry: Union[Point, list, StepBuffer], lift_height: float) -> list|StepBuffer:
+    '''travel vertically by lift_height from Point or last position in provided geometry
     '''
-    if type(geometry) == list:
-        final_point_index = max(index for index, item in enumerate(geometry) if type(item) == Point)
-        return travel_to(Point(x=geometry[final_point_index].x, y=geometry[final_point_index].y, z=geometry[final_point_index].z+lift_height))
+    if isinstance(geometry, StepBuffer):
+        x, y, z = geometry.position
+        lifted = StepBuffer(capacity=1)
+        lifted.travel_to(x, y, z+lift_height)
+        return lifted
+    elif type(geometry) == list:
+        # search from the end, the last Point is usually one of the last steps
+        final_point = next((item for item in reversed(geometry) if type(item) == Point), None)
+        if final_point is None:
+            raise Exception("geometry does not contain any Points")
+        return travel_to(Point(x=final_point.x, y=final_point.y, z=final_point.z+lift_height))
     else:
         return travel_to(Point(x=geometry.x, y=geometry.y, z=geometry.z+lift_height))
 
-def z_unlift(geometry: Union[Point, list], lift_height: float) -> list:
+def z_lift(geometry: Union[Point, list, StepBuffer], lift_height: float) -> list|StepBuffer:
+    '''lift z from Point or last position in provided geometry, extend to geometry
+    '''
+    return _lifted(geometry, lift_height)
+
+def z_unlift(geometry: Union[Point, list, StepBuffer], lift_height: float) -> list|StepBuffer:
     '''unlift z from Point or last position in provided geometry, extend to geometry
     '''
-    if type(geometry) == list:
-        final_point_index = max(index for index, item in enumerate(geometry) if type(item) == Point)
-        return travel_to(Point(x=geometry[final_point_index].x, y=geometry[final_point_index].y, z=geometry[final_point_index].z-lift_height))
-    else:
-        return travel_to(Point(x=geometry.x, y=geometry.y, z=geometry.z-lift_height))
\ No newline at end of file
+    return _lifted(geometry, -lift_height)